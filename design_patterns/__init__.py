@@ -0,0 +1,16 @@
+"""
+Design Patterns
+===============
+
+Practice implementations of the gang-of-four patterns, plus a few that are
+particular to Python. Subpackages are imported on first access.
+"""
+
+from design_patterns import _lazy
+
+__getattr__, __dir__, __all__ = _lazy.attach(__name__, [
+    "behavioral",
+    "creational",
+    "python",
+    "structural",
+])
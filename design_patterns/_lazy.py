@@ -0,0 +1,29 @@
+"""
+Lazy loading of submodules on attribute access.
+
+Packages declare their submodules and expose the ``__getattr__`` and
+``__dir__`` returned here, so ``design_patterns.creational.builder`` is only
+imported the first time it is touched.
+"""
+
+import importlib
+
+
+def attach(package_name, submodules):
+    """ Return ``(__getattr__, __dir__, __all__)`` for a package whose
+    ``submodules`` should be imported on first access.
+    """
+    submodules = sorted(submodules)
+    names = frozenset(submodules)
+
+    def __getattr__(name):
+        if name in names:
+            return importlib.import_module(
+                "{}.{}".format(package_name, name))
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(package_name, name))
+
+    def __dir__():
+        return list(submodules)
+
+    return __getattr__, __dir__, list(submodules)
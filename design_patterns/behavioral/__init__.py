@@ -0,0 +1,17 @@
+"""
+Behavioral Patterns
+===================
+"""
+
+from design_patterns import _lazy
+
+__getattr__, __dir__, __all__ = _lazy.attach(__name__, [
+    "chain_of_responsibility",
+    "command",
+    "interpreter",
+    "iterator",
+    "mediator",
+    "memento",
+    "state",
+    "tree_iterator",
+])
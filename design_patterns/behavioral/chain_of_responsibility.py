@@ -52,24 +52,40 @@ Consequences
 3. Receipt isn't guaranteed.
 """
 
+import bisect
+import math
+import time
 from abc import ABC
 from abc import abstractmethod
 
 
 class Spell:
-    def __init__(self, name):
+    __slots__ = ("name", "chain")
+
+    #: The chain, declared from first handler to last. Spells with the same
+    #: declaration share one chain, see ChainRegistry.
+    handlers = (
+        "ConcreteHandler1",
+        "ConcreteHandler2",
+        "ConcreteHandler3",
+        "ConcreteHandler4",
+    )
+
+    def __init__(self, name, handlers=None):
         self.name = name
-        self.chain = ConcreteHandler1(
-            ConcreteHandler2(
-                ConcreteHandler3(
-                    ConcreteHandler4()
-                )
-            )
-        )
+        self.chain = chains.get(handlers or self.handlers)
 
     def cast(self, creature):
         self.chain.handle(creature)
 
+    def cast_batch(self, values):
+        """ Return the position in the chain of the handler for each
+        attribute value, see CompiledChain.resolve.
+        """
+        if not isinstance(self.chain, CompiledChain):
+            raise TypeError("Only threshold chains can be cast in batches")
+        return self.chain.resolve(values)
+
 
 class Magician:
     def __init__(self, name, intelligence):
@@ -82,44 +98,445 @@ class Magician:
 
 
 class AbstractHandler(ABC):
+    #: Whether the handler's predicate is independent of the handlers
+    #: around it, so that ChainExecutor may try it in a different order.
+    commutative = False
+
     def __init__(self, successor=None):
         self._successor = successor
 
     def handle(self, creature):
-        reaction = self._handle(creature)
-        if not reaction:
-            self._successor.handle(creature)
+        """ Pass the request along the chain until a handler accepts it.
+        Returns whether any handler did.
+        """
+        handler = self
+        while handler is not None:
+            if handler._handle(creature):
+                return True
+            handler = handler._successor
+        return False
 
     @abstractmethod
     def _handle(self, spell):
         raise NotImplementedError("Must provide implementation in subclass")
 
 
-class ConcreteHandler1(AbstractHandler):
-    def _handle(self, creature):
-        if creature.intelligence < 10:
-            print("Spell backfires")
-            return True
+class ThresholdHandler(AbstractHandler):
+    """ Handles creatures whose ``attribute`` is below ``threshold``.
 
+    Declaring the predicate as data, rather than code in ``_handle``, lets
+    compile_chain turn a chain of these into a lookup table.
+    """
+    attribute = "intelligence"
+    threshold = math.inf
 
-class ConcreteHandler2(AbstractHandler):
     def _handle(self, creature):
-        if creature.intelligence < 20:
-            print("Small fire ball is cast")
+        if getattr(creature, self.attribute) < self.threshold:
+            self.react(creature)
             return True
 
+    @abstractmethod
+    def react(self, creature):
+        raise NotImplementedError("Must provide implementation in subclass")
 
-class ConcreteHandler3(AbstractHandler):
-    def _handle(self, creature):
-        if creature.intelligence < 30:
-            print("A fire ball blazes across the room")
-            return True
 
+class ConcreteHandler1(ThresholdHandler):
+    threshold = 10
 
-class ConcreteHandler4(AbstractHandler):
-    def _handle(self, creature):
+    def react(self, creature):
+        print("Spell backfires")
+
+
+class ConcreteHandler2(ThresholdHandler):
+    threshold = 20
+
+    def react(self, creature):
+        print("Small fire ball is cast")
+
+
+class ConcreteHandler3(ThresholdHandler):
+    threshold = 30
+
+    def react(self, creature):
+        print("A fire ball blazes across the room")
+
+
+class ConcreteHandler4(ThresholdHandler):
+    def react(self, creature):
         print("A Massive column of fire burns through the wall!")
-        return True
+
+
+class HandlerStats:
+    __slots__ = ("evaluations", "hits", "seconds")
+
+    def __init__(self):
+        self.evaluations = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return "<HandlerStats {}/{} hits, {:.6f}s>".format(
+            self.hits, self.evaluations, self.seconds)
+
+
+class ChainExecutor:
+    """ Runs a chain iteratively, counting each handler's evaluations, hits
+    and (with ``timed``) evaluation time.
+
+    With ``adaptive`` set, every ``reorder_every`` requests each run of
+    adjacent commutative handlers is re-sorted so the handlers that match
+    most often are tried first. Non-commutative handlers keep their
+    position and are never moved past.
+    """
+
+    def __init__(self, chain, adaptive=False, reorder_every=1000, timed=False):
+        self.handlers = list(_walk(chain))
+        self.stats = {id(handler): HandlerStats() for handler in self.handlers}
+        self.adaptive = adaptive
+        self.reorder_every = reorder_every
+        self.timed = timed
+        self._requests = 0
+
+    def handle(self, request):
+        """Return the handler that accepted the request, or None"""
+        stats = self.stats
+        accepted = None
+        for handler in self.handlers:
+            handler_stats = stats[id(handler)]
+            handler_stats.evaluations += 1
+            if self.timed:
+                start = time.perf_counter()
+                reaction = handler._handle(request)
+                handler_stats.seconds += time.perf_counter() - start
+            else:
+                reaction = handler._handle(request)
+            if reaction:
+                handler_stats.hits += 1
+                accepted = handler
+                break
+        self._requests += 1
+        if self.adaptive and self._requests % self.reorder_every == 0:
+            self.reorder()
+        return accepted
+
+    def reorder(self):
+        """Sort each run of commutative handlers by hits, most first"""
+        stats = self.stats
+        ordered, run = [], []
+        for handler in self.handlers + [None]:
+            if handler is not None and handler.commutative:
+                run.append(handler)
+                continue
+            run.sort(key=lambda h: stats[id(h)].hits, reverse=True)
+            ordered.extend(run)
+            run = []
+            if handler is not None:
+                ordered.append(handler)
+        self.handlers = ordered
+
+    def report(self):
+        return [(type(handler).__name__, self.stats[id(handler)])
+                for handler in self.handlers]
+
+
+class _TagHandler(AbstractHandler):
+    commutative = True
+
+    def __init__(self, tag, successor=None):
+        super().__init__(successor)
+        self.tag = tag
+
+    def _handle(self, request):
+        return request == self.tag
+
+
+def benchmark_executor(length=500, requests=100000):
+    """ Compare a static and an adaptive executor over a long chain of
+    commutative handlers, where most requests match near the chain's end.
+    """
+    import random
+
+    chain = None
+    for tag in reversed(range(length)):
+        chain = _TagHandler(tag, chain)
+    weights = [(tag + 1) ** 4 for tag in range(length)]
+    stream = random.choices(range(length), weights=weights, k=requests)
+
+    for adaptive in (False, True):
+        executor = ChainExecutor(chain, adaptive=adaptive)
+        start = time.perf_counter()
+        for request in stream:
+            executor.handle(request)
+        elapsed = time.perf_counter() - start
+        evaluations = sum(stats.evaluations
+                          for stats in executor.stats.values())
+        print("{:<8} {:.2f}s, {:.1f} handlers tried per request".format(
+            "adaptive" if adaptive else "static", elapsed,
+            evaluations / requests))
+
+
+class CompiledChain:
+    """ A chain of ThresholdHandlers on one attribute, collapsed into a
+    sorted table of thresholds.
+
+    The first handler in the chain whose threshold is above the value is
+    the first threshold above it in the table, found with bisect in
+    O(log n). Handlers shadowed by an earlier, higher threshold can never
+    be reached and are left out of the table.
+    """
+
+    __slots__ = ("attribute", "_thresholds", "_handlers", "_positions")
+
+    #: Batches at or above this size use NumPy when it is installed.
+    VECTORIZE_ABOVE = 1024
+
+    def __init__(self, attribute, thresholds, handlers, positions):
+        self.attribute = attribute
+        self._thresholds = thresholds
+        self._handlers = handlers
+        self._positions = positions
+
+    def handle(self, creature):
+        """Returns whether any handler accepted the creature"""
+        index = bisect.bisect_right(
+            self._thresholds, getattr(creature, self.attribute))
+        if index < len(self._handlers):
+            self._handlers[index].react(creature)
+            return True
+        return False
+
+    def resolve(self, values):
+        """ Return a list of the chain position of the handler for each
+        value, or -1 when no handler in the chain accepts it.
+        """
+        positions = self._positions + (-1,)
+        if len(values) >= self.VECTORIZE_ABOVE:
+            try:
+                import numpy
+            except ImportError:
+                pass
+            else:
+                indexes = numpy.searchsorted(
+                    self._thresholds, values, side="right")
+                return numpy.asarray(positions)[indexes].tolist()
+        thresholds = self._thresholds
+        return [positions[bisect.bisect_right(thresholds, value)]
+                for value in values]
+
+
+def _walk(chain):
+    handler = chain
+    while handler is not None:
+        yield handler
+        handler = handler._successor
+
+
+def _compilable(handler):
+    cls = type(handler)
+    return (isinstance(handler, ThresholdHandler)
+            and cls._handle is ThresholdHandler._handle
+            and cls.handle is AbstractHandler.handle)
+
+
+def compile_chain(chain):
+    """ Compile a chain of ThresholdHandlers on a single attribute into a
+    CompiledChain. Any other chain, including one with a handler that
+    overrides ``_handle`` or ``handle``, is returned unchanged, to be
+    walked handler by handler.
+    """
+    handlers = list(_walk(chain))
+    if not all(_compilable(handler) for handler in handlers):
+        return chain
+    attributes = {handler.attribute for handler in handlers}
+    if len(attributes) != 1:
+        return chain
+
+    thresholds, reachable, positions = [], [], []
+    for position, handler in enumerate(handlers):
+        if not thresholds or handler.threshold > thresholds[-1]:
+            thresholds.append(handler.threshold)
+            reachable.append(handler)
+            positions.append(position)
+    return CompiledChain(attributes.pop(), tuple(thresholds),
+                         tuple(reachable), tuple(positions))
+
+
+class FrozenChain:
+    """ A chain that can't be relinked, for sharing between spells and
+    threads. Handlers are tried in order, as AbstractHandler.handle does.
+    """
+    __slots__ = ("_handlers",)
+
+    def __init__(self, chain):
+        self._handlers = tuple(_walk(chain))
+
+    def handle(self, creature):
+        for handler in self._handlers:
+            if handler._handle(creature):
+                return True
+        return False
+
+
+def build_chain(definition):
+    """ Link a chain from a declaration of handlers, first to last. Each
+    entry is a handler class, the name of one in this module, or any
+    callable taking the successor.
+    """
+    chain = None
+    for handler in reversed(definition):
+        if isinstance(handler, str):
+            handler = globals()[handler]
+        chain = handler(chain)
+    return chain
+
+
+class ChainRegistry:
+    """ Builds each distinct chain declaration once.
+
+    The handlers in a chain are stateless, so every spell with the same
+    declaration can share one compiled (or frozen) chain. Declarations may
+    only name handler classes, by class or by name, so that equal
+    declarations share an entry. Link chains of other callables with
+    build_chain.
+    """
+
+    def __init__(self):
+        self._chains = {}
+
+    def get(self, definition):
+        definition = tuple(
+            globals()[handler] if isinstance(handler, str) else handler
+            for handler in definition)
+        for handler in definition:
+            if not isinstance(handler, type):
+                raise TypeError(
+                    "Chains are declared with handler classes, got {!r}"
+                    .format(handler))
+        try:
+            return self._chains[definition]
+        except KeyError:
+            pass
+        chain = compile_chain(build_chain(definition))
+        if not isinstance(chain, CompiledChain):
+            chain = FrozenChain(chain)
+        return self._chains.setdefault(definition, chain)
+
+    def __len__(self):
+        return len(self._chains)
+
+
+chains = ChainRegistry()
+
+
+class AsyncHandler(ABC):
+    """ A handler whose check may wait on I/O.
+
+    The check must not have side effects, so that AsyncChain can run it
+    speculatively; only the handler that wins runs ``react``.
+    """
+
+    def __init__(self, successor=None):
+        self._successor = successor
+
+    @abstractmethod
+    async def check(self, request):
+        raise NotImplementedError("Must provide implementation in subclass")
+
+    async def react(self, request):
+        pass
+
+    async def handle(self, request):
+        """Return the handler that accepted the request, or None"""
+        handler = self
+        while handler is not None:
+            if await handler.check(request):
+                await handler.react(request)
+                return handler
+            handler = handler._successor
+        return None
+
+
+class AsyncChain:
+    """ Runs a chain of AsyncHandlers.
+
+    With ``speculate`` above one, the checks of the next ``speculate``
+    handlers run concurrently. Results are still taken in chain order, so
+    the first handler in the chain that accepts wins, and the checks still
+    running after it are cancelled.
+    """
+
+    def __init__(self, chain, speculate=1):
+        self.handlers = tuple(_walk(chain))
+        self.speculate = speculate
+
+    async def handle(self, request):
+        if self.speculate <= 1:
+            return await self.handlers[0].handle(request)
+
+        import asyncio
+
+        handlers = self.handlers
+        window = {}
+        started = 0
+        try:
+            for index, handler in enumerate(handlers):
+                limit = min(len(handlers), index + self.speculate)
+                while started < limit:
+                    window[started] = asyncio.ensure_future(
+                        handlers[started].check(request))
+                    started += 1
+                if await window.pop(index):
+                    await handler.react(request)
+                    return handler
+            return None
+        finally:
+            for task in window.values():
+                task.cancel()
+
+
+class _SlowHandler(AsyncHandler):
+    """A stand-in for a handler backed by a remote check"""
+
+    def __init__(self, tag, delay, successor=None):
+        super().__init__(successor)
+        self.tag = tag
+        self.delay = delay
+
+    async def check(self, request):
+        import asyncio
+
+        await asyncio.sleep(self.delay)
+        return request == self.tag
+
+
+def benchmark_async(length=8, requests=200, speculate=(1, 4, 8)):
+    """ Compare request latency percentiles for sequential and speculative
+    evaluation of a chain of slow handlers.
+    """
+    import asyncio
+    import random
+    import statistics
+
+    rng = random.Random(0)
+    chain = None
+    for tag in reversed(range(length)):
+        chain = _SlowHandler(tag, rng.uniform(0.001, 0.005), chain)
+    stream = [rng.randrange(length) for _ in range(requests)]
+
+    async def run(executor):
+        latencies = []
+        for request in stream:
+            start = time.perf_counter()
+            await executor.handle(request)
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    for window in speculate:
+        latencies = asyncio.run(run(AsyncChain(chain, speculate=window)))
+        p50, p90, p99 = (statistics.quantiles(latencies, n=100)[i]
+                         for i in (49, 89, 98))
+        print("speculate={} p50 {:.1f}ms p90 {:.1f}ms p99 {:.1f}ms".format(
+            window, p50, p90, p99))
 
 
 if __name__ == '__main__':
@@ -134,3 +551,10 @@ if __name__ == '__main__':
     for wizard in wizards:
         wizard.cast_spell(fire_spell)
         print("")
+
+    ice_spell = Spell("Ice Shard", ("ConcreteHandler2", "ConcreteHandler4"))
+    gandalf.cast_spell(ice_spell)
+    print("")
+
+    intelligences = [wizard.intelligence for wizard in wizards]
+    print("Handlers: {}".format(fire_spell.cast_batch(intelligences)))
@@ -79,7 +79,16 @@ Consequences
 # an event.
 
 
+import bisect
+import mmap
 import os
+import queue
+import struct
+import threading
+import time
+import weakref
+from array import array
+from collections import deque
 from os.path import lexists
 
 
@@ -96,6 +105,14 @@ class Wizard:
         self._y += dy
         print(self._name, "moved to {}, {}".format(self._x, self._y))
 
+    @property
+    def position(self):
+        return self._x, self._y
+
+    def place(self, co_ords):
+        self._x, self._y = co_ords
+        print(self._name, "moved to {}, {}".format(self._x, self._y))
+
     def at_origin(self):
         if self._x == 0 and self._y == 0:
             print(self._name, "is at origin.")
@@ -104,23 +121,507 @@ class Wizard:
 
 
 class MoveCommand:
+    """ Moves a creature one step. Commands never change after they are
+    created, so execute and undo can be repeated in any order.
+    """
+    __slots__ = ("_creature", "_movement")
 
-    direction = {'left': [-1, 0],
-                 'right': [+1, 0],
-                 'up': [0, +1],
-                 'down': [0, -1]}
+    direction = {'left': (-1, 0),
+                 'right': (+1, 0),
+                 'up': (0, +1),
+                 'down': (0, -1)}
 
     def __init__(self, creature, dest):
         self._creature = creature
         self._movement = self.direction[dest]
 
     def undo(self):
-        self._movement = [i*-1 for i in self._movement]
-        self._creature.move(self._movement)
+        dx, dy = self._movement
+        self._creature.move((-dx, -dy))
 
     def execute(self):
         self._creature.move(self._movement)
 
+    def coalesce(self):
+        return [(self._creature, self._movement)]
+
+
+class MoveBatch:
+    """ A composite command that merges consecutive moves of the same
+    creature into one net displacement before executing them.
+
+    The batch can be undone as a whole, or one command at a time from the
+    most recent.
+    """
+
+    def __init__(self, commands=()):
+        self._commands = list(commands)
+
+    def append(self, command):
+        self._commands.append(command)
+
+    def __len__(self):
+        return len(self._commands)
+
+    def coalesce(self):
+        """Return ``(creature, [dx, dy])`` for each run of moves"""
+        moves = []
+        creature, dx, dy = None, 0, 0
+        for command in self._commands:
+            if command._creature is not creature:
+                if creature is not None and (dx or dy):
+                    moves.append((creature, [dx, dy]))
+                creature, dx, dy = command._creature, 0, 0
+            dx += command._movement[0]
+            dy += command._movement[1]
+        if creature is not None and (dx or dy):
+            moves.append((creature, [dx, dy]))
+        return moves
+
+    def execute(self):
+        for creature, movement in self.coalesce():
+            creature.move(movement)
+
+    def undo(self):
+        for creature, (dx, dy) in reversed(self.coalesce()):
+            creature.move([-dx, -dy])
+
+    def undo_command(self):
+        """Undo only the most recent command and drop it from the batch"""
+        command = self._commands.pop()
+        command.undo()
+        return command
+
+
+class CommandJournal:
+    """ An append-only file of fixed-width command records.
+
+    Each record is (entity id, command type, dx, dy). Appends are buffered
+    and written together by ``commit``, once every ``group_size`` records
+    or when asked. ``fsync_every`` sets how many commits go by between
+    fsyncs, with 0 leaving durability to the operating system. Opening a
+    journal trims a record torn by a crash, so new records stay aligned.
+    """
+
+    RECORD = struct.Struct("<IIii")
+    MOVE = 1
+
+    def __init__(self, path, group_size=1024, fsync_every=1):
+        self._file = open(path, "ab")
+        torn = self._file.tell() % self.RECORD.size
+        if torn:
+            self._file.truncate(self._file.tell() - torn)
+        self._buffer = bytearray()
+        self._pending = 0
+        self._commits = 0
+        self.group_size = group_size
+        self.fsync_every = fsync_every
+
+    def append(self, entity_id, command_type, dx, dy):
+        self._buffer += self.RECORD.pack(entity_id, command_type, dx, dy)
+        self._pending += 1
+        if self._pending >= self.group_size:
+            self.commit()
+
+    def append_move(self, entity_id, command):
+        dx, dy = command._movement
+        self.append(entity_id, self.MOVE, dx, dy)
+
+    def commit(self):
+        """Write every pending record, syncing according to the policy"""
+        if not self._pending:
+            return
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer.clear()
+        self._pending = 0
+        self._commits += 1
+        if self.fsync_every and self._commits % self.fsync_every == 0:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self.commit()
+        if self.fsync_every:
+            os.fsync(self._file.fileno())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def replay_journal(path, positions=None):
+    """ Rebuild entity positions from a journal.
+
+    ``positions`` maps entity ids to their starting ``[x, y]``, missing
+    entities start at the origin. A torn record at the end of the file,
+    left by a crash mid-write, is ignored.
+    """
+    positions = {} if positions is None else positions
+    record = CommandJournal.RECORD
+    size = os.path.getsize(path) // record.size * record.size
+    if not size:
+        return positions
+    with open(path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)[:size]
+        try:
+            _replay_numpy(view, positions)
+        except ImportError:
+            for entity_id, command_type, dx, dy in record.iter_unpack(view):
+                if command_type == CommandJournal.MOVE:
+                    position = positions.setdefault(entity_id, [0, 0])
+                    position[0] += dx
+                    position[1] += dy
+        finally:
+            view.release()
+    return positions
+
+
+def _replay_numpy(view, positions):
+    import numpy
+
+    records = numpy.frombuffer(view, dtype=numpy.dtype([
+        ("entity", "<u4"), ("type", "<u4"), ("dx", "<i4"), ("dy", "<i4"),
+    ]))
+    moves = records[records["type"] == CommandJournal.MOVE]
+    entities, index = numpy.unique(moves["entity"], return_inverse=True)
+    dx = numpy.bincount(index, weights=moves["dx"], minlength=len(entities))
+    dy = numpy.bincount(index, weights=moves["dy"], minlength=len(entities))
+    for entity_id, x, y in zip(entities.tolist(), dx.tolist(), dy.tolist()):
+        position = positions.setdefault(entity_id, [0, 0])
+        position[0] += int(x)
+        position[1] += int(y)
+    del records, moves
+
+
+def benchmark_journal(records=100000000, entities=1000, path=None):
+    """ Measure journal append throughput and replay speed. 100M records
+    take 1.6GB of disk, pass a smaller ``records`` for a quick run.
+    """
+    import random
+    import tempfile
+
+    directory = None
+    if path is None:
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, "commands.journal")
+    moves = list(MoveCommand.direction.values())
+    ids = [random.randrange(entities) for _ in range(4096)]
+    try:
+        start = time.perf_counter()
+        with CommandJournal(path, group_size=4096, fsync_every=64) as journal:
+            append = journal.append
+            for i in range(records):
+                dx, dy = moves[i & 3]
+                append(ids[i & 4095], CommandJournal.MOVE, dx, dy)
+        appended = time.perf_counter() - start
+
+        start = time.perf_counter()
+        replay_journal(path)
+        replayed = time.perf_counter() - start
+    finally:
+        if directory is not None:
+            directory.cleanup()
+    print("append {:,.0f} records/s".format(records / appended))
+    print("replay {:,.0f} records/s".format(records / replayed))
+
+
+class _Snapshot:
+    """The net displacement of every creature over a run of commands"""
+    __slots__ = ("moves", "size")
+
+    def __init__(self):
+        self.moves = {}
+        self.size = 0
+
+    def fold(self, command):
+        for creature, (dx, dy) in command.coalesce():
+            x, y = self.moves.get(creature, (0, 0))
+            self.moves[creature] = x + dx, y + dy
+        self.size += 1
+
+    def execute(self):
+        for creature, movement in self.moves.items():
+            if movement != (0, 0):
+                creature.move(movement)
+
+    def undo(self):
+        for creature, (dx, dy) in self.moves.items():
+            if dx or dy:
+                creature.move((-dx, -dy))
+
+
+class UndoManager:
+    """ Bounded undo and redo for move commands.
+
+    The ``limit`` most recent commands are kept individually. When there
+    are more, the oldest half is folded into a snapshot of net moves, which
+    can still be undone, but only as a whole. At most ``max_snapshots`` are
+    kept; older history is forgotten. Every operation is amortised O(1).
+    """
+
+    def __init__(self, limit=1000, max_snapshots=16):
+        self.limit = limit
+        self._recent = deque()
+        self._snapshots = deque(maxlen=max_snapshots)
+        self._redo = []
+
+    def execute(self, command):
+        command.execute()
+        self._redo.clear()
+        self._push(command)
+
+    def _push(self, command):
+        self._recent.append(command)
+        if len(self._recent) > self.limit:
+            snapshot = _Snapshot()
+            for _ in range(max(1, self.limit // 2)):
+                snapshot.fold(self._recent.popleft())
+            self._snapshots.append(snapshot)
+
+    def undo(self):
+        """Undo the latest command or snapshot, returning False if none"""
+        if self._recent:
+            entry = self._recent.pop()
+        elif self._snapshots:
+            entry = self._snapshots.pop()
+        else:
+            return False
+        entry.undo()
+        self._redo.append(entry)
+        return True
+
+    def redo(self):
+        """Redo the latest undone entry, returning False if none"""
+        if not self._redo:
+            return False
+        entry = self._redo.pop()
+        entry.execute()
+        if isinstance(entry, _Snapshot):
+            self._snapshots.append(entry)
+        else:
+            self._push(entry)
+        return True
+
+    def __len__(self):
+        """The number of commands that can still be undone"""
+        return len(self._recent) + sum(s.size for s in self._snapshots)
+
+
+class CommandDispatcher:
+    """ Executes commands on a pool of worker threads.
+
+    Commands are partitioned by the creature they act on, and every
+    creature is served by a single worker, so commands one thread submits
+    for a creature run in that order while different creatures run
+    concurrently. Commands from several producer threads are only ordered
+    by when their ``submit`` calls reach the queue. Creatures are assigned
+    to workers in turn and must support weak references, so the dispatcher
+    doesn't keep them alive. Each worker's queue holds at most
+    ``queue_size`` commands; ``submit`` blocks when it is full, which
+    slows producers down to the workers' pace.
+    """
+
+    def __init__(self, workers=4, queue_size=1024):
+        self._queues = [queue.Queue(queue_size) for _ in range(workers)]
+        self._assigned = weakref.WeakKeyDictionary()
+        self._assign_lock = threading.Lock()
+        self._next_worker = 0
+        self._errors = []
+        self._threads = [
+            threading.Thread(target=self._work, args=(q,), daemon=True)
+            for q in self._queues
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self, commands):
+        while True:
+            command = commands.get()
+            try:
+                if command is None:
+                    return
+                command.execute()
+            except Exception as error:
+                self._errors.append(error)
+            finally:
+                commands.task_done()
+
+    def submit(self, command, timeout=None):
+        """ Queue a command behind earlier ones for the same creature.
+        Raises queue.Full if there is still no room after ``timeout``.
+        """
+        creature = command._creature
+        with self._assign_lock:
+            worker = self._assigned.get(creature)
+            if worker is None:
+                worker = self._next_worker
+                self._next_worker = (worker + 1) % len(self._queues)
+                self._assigned[creature] = worker
+        self._queues[worker].put(command, timeout=timeout)
+
+    def join(self):
+        """Wait for every queued command, re-raising the first failure"""
+        for commands in self._queues:
+            commands.join()
+        if self._errors:
+            error, self._errors = self._errors[0], []
+            raise error
+
+    def close(self):
+        for commands in self._queues:
+            commands.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _RemoteWizard(Wizard):
+    """A wizard whose moves wait on I/O, for benchmarking"""
+
+    def __init__(self, name, delay):
+        super().__init__(name, 0, 0)
+        self.delay = delay
+
+    def move(self, co_ords):
+        time.sleep(self.delay)
+        dx, dy = co_ords
+        self._x += dx
+        self._y += dy
+
+
+def benchmark_dispatcher(entity_counts=(1, 8, 64), worker_counts=(1, 4, 16),
+                         commands=2000, delay=0.0002):
+    """Commands per second across entity and worker counts"""
+    import random
+
+    dests = list(MoveCommand.direction)
+    for entities in entity_counts:
+        wizards = [_RemoteWizard(str(i), delay) for i in range(entities)]
+        stream = [MoveCommand(random.choice(wizards), random.choice(dests))
+                  for _ in range(commands)]
+        for workers in worker_counts:
+            with CommandDispatcher(workers=workers) as dispatcher:
+                start = time.perf_counter()
+                for command in stream:
+                    dispatcher.submit(command)
+                dispatcher.join()
+                elapsed = time.perf_counter() - start
+            print("{:>3} entities {:>3} workers {:>9,.0f} commands/s".format(
+                entities, workers, commands / elapsed))
+
+
+class _Track:
+    """The steps at which one entity moved and its position after each"""
+    __slots__ = ("origin", "steps", "xs", "ys")
+
+    def __init__(self, origin):
+        self.origin = tuple(origin)
+        self.steps = array("q")
+        self.xs = array("q")
+        self.ys = array("q")
+
+
+class CommandHistory:
+    """ An index over a stream of move commands.
+
+    Each entity keeps the steps it moved at and a running prefix sum of
+    its position, so the position of any entity at any step is a binary
+    search away, and rewinding to a step places each entity directly
+    instead of undoing every command in between.
+
+    Entities are creatures with ``position`` and ``place``, or plain ids
+    when the history was built with ``from_arrays``.
+    """
+
+    def __init__(self):
+        self._tracks = {}
+        self._origins = {}
+        self.step = 0
+
+    def execute(self, command):
+        """Execute a move command and record it as the next step"""
+        creature = command._creature
+        track = self._tracks.get(creature)
+        if track is None:
+            track = self._tracks[creature] = _Track(creature.position)
+        command.execute()
+        dx, dy = command._movement
+        x, y = (track.xs[-1], track.ys[-1]) if track.steps else track.origin
+        track.steps.append(self.step)
+        track.xs.append(x + dx)
+        track.ys.append(y + dy)
+        self.step += 1
+
+    @classmethod
+    def from_arrays(cls, entity_ids, dx, dy, origins=None):
+        """ Build a history from a whole command stream at once, given as
+        NumPy arrays (or sequences) with one entry per step, such as the
+        records of a CommandJournal.
+        """
+        import numpy
+
+        entity_ids = numpy.asarray(entity_ids)
+        dx = numpy.asarray(dx, dtype=numpy.int64)
+        dy = numpy.asarray(dy, dtype=numpy.int64)
+        origins = origins or {}
+        history = cls()
+        history._origins = origins
+        history.step = len(entity_ids)
+        order = numpy.argsort(entity_ids, kind="stable")
+        entities, starts = numpy.unique(entity_ids[order], return_index=True)
+        stops = numpy.append(starts[1:], len(order))
+        for entity, start, stop in zip(entities.tolist(), starts, stops):
+            steps = order[start:stop]
+            track = _Track(origins.get(entity, (0, 0)))
+            track.steps.frombytes(steps.astype(numpy.int64).tobytes())
+            for column, moves, offset in ((track.xs, dx, track.origin[0]),
+                                          (track.ys, dy, track.origin[1])):
+                positions = numpy.cumsum(moves[steps]) + offset
+                column.frombytes(positions.astype(numpy.int64).tobytes())
+            history._tracks[entity] = track
+        return history
+
+    def position(self, entity, step):
+        """ Return where ``entity`` was after the first ``step`` steps. An
+        entity that never moved is at its current ``position``, or for a
+        plain id at its origin given to ``from_arrays``, else (0, 0).
+        """
+        track = self._tracks.get(entity)
+        if track is None:
+            if hasattr(entity, "position"):
+                return tuple(entity.position)
+            return tuple(self._origins.get(entity, (0, 0)))
+        moved = bisect.bisect_left(track.steps, step)
+        if not moved:
+            return track.origin
+        return track.xs[moved - 1], track.ys[moved - 1]
+
+    def positions(self, step):
+        """Return every entity's position after the first ``step`` steps"""
+        return {entity: self.position(entity, step) for entity in self._tracks}
+
+    def undo_to(self, step):
+        """ Rewind to ``step``, placing each creature that moved since in
+        one assignment and forgetting the later steps.
+        """
+        for entity, track in self._tracks.items():
+            moved = bisect.bisect_left(track.steps, step)
+            if moved == len(track.steps):
+                continue
+            del track.steps[moved:], track.xs[moved:], track.ys[moved:]
+            if hasattr(entity, "place"):
+                entity.place(self.position(entity, step))
+        self.step = min(self.step, step)
+
 
 def main():
     command_stack = []
@@ -142,6 +643,58 @@ def main():
         cmd.undo()
     wizard.at_origin()
 
+    # The same stream as a batch moves the wizard twice, not five times
+    batch = MoveBatch(MoveCommand(wizard, 'up') for _ in range(3))
+    batch.append(MoveCommand(wizard, 'right'))
+    batch.append(MoveCommand(wizard, 'right'))
+    batch.execute()
+    batch.undo_command()
+    batch.undo()
+    wizard.at_origin()
+
+    # Undoing and redoing through a bounded history
+    manager = UndoManager(limit=2)
+    for dest in ['up', 'up', 'right']:
+        manager.execute(MoveCommand(wizard, dest))
+    while manager.undo():
+        pass
+    wizard.at_origin()
+    manager.redo()
+    manager.undo()
+
+    # Dispatching commands for many wizards at once
+    with CommandDispatcher(workers=2) as dispatcher:
+        for dest in ['up', 'right', 'down', 'left']:
+            dispatcher.submit(MoveCommand(wizard, dest))
+        dispatcher.join()
+    wizard.at_origin()
+
+    # Indexing the history to jump between steps
+    history = CommandHistory()
+    for dest in ['up', 'up', 'up', 'right', 'right']:
+        history.execute(MoveCommand(wizard, dest))
+    print("Position at step 3: {}".format(history.position(wizard, 3)))
+    history.undo_to(0)
+    wizard.at_origin()
+
+    # Journaling commands so positions survive a crash
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "commands.journal")
+        with CommandJournal(path) as journal:
+            for dest in ['up', 'up', 'up', 'right', 'right']:
+                journal.append_move(1, MoveCommand(wizard, dest))
+        print("Replayed positions: {}".format(replay_journal(path)))
+
+        # A crash mid-write leaves a torn record, trimmed on reopening
+        with open(path, "ab") as f:
+            f.write(b"\0\0\0")
+        with CommandJournal(path) as journal:
+            for dest in ['left', 'left']:
+                journal.append_move(1, MoveCommand(wizard, dest))
+        print("Replayed after a crash: {}".format(replay_journal(path)))
+
 
 if __name__ == "__main__":
     main()
@@ -37,3 +37,467 @@ Consequences
 3. Complex grammars are hard to maintain.
 4. Adding new ways to interpret expressions.
 """
+
+import time
+
+
+class RegularExpression:
+    """ The abstract expression. ``interpret`` takes the positions in the
+    input at which matching may continue and returns the positions reached
+    after matching this expression from any of them.
+    """
+
+    def interpret(self, text, positions):
+        raise NotImplementedError("Must provide implementation in subclass")
+
+    def match(self, text):
+        """Whether the expression matches the whole of ``text``"""
+        return len(text) in self.interpret(text, {0})
+
+    def compile(self, binary=False):
+        """ Lower the expression to an automaton that matches in time
+        linear in the input. With ``binary`` it matches bytes-like input
+        (literals are UTF-8 encoded), otherwise str.
+        """
+        nfa = _NFA(binary)
+        start, end = self._to_nfa(nfa)
+        return Automaton(nfa, start, end)
+
+    def _to_nfa(self, nfa):
+        raise NotImplementedError("Must provide implementation in subclass")
+
+    def __or__(self, other):
+        return AlternationExpression(self, _expression(other))
+
+    def __ror__(self, other):
+        return AlternationExpression(_expression(other), self)
+
+    def __add__(self, other):
+        return SequenceExpression(self, _expression(other))
+
+    def __radd__(self, other):
+        return SequenceExpression(_expression(other), self)
+
+    def repeat(self):
+        return RepetitionExpression(self)
+
+
+def _expression(value):
+    if isinstance(value, RegularExpression):
+        return value
+    return LiteralExpression(value)
+
+
+class LiteralExpression(RegularExpression):
+    def __init__(self, literal):
+        self.literal = literal
+
+    def interpret(self, text, positions):
+        size = len(self.literal)
+        return {position + size for position in positions
+                if text.startswith(self.literal, position)}
+
+    def _to_nfa(self, nfa):
+        start = end = nfa.state()
+        for symbol in nfa.symbols(self.literal):
+            following = nfa.state()
+            nfa.edge(end, symbol, following)
+            end = following
+        return start, end
+
+    def __repr__(self):
+        return repr(self.literal)
+
+
+class AlternationExpression(RegularExpression):
+    def __init__(self, alternative1, alternative2):
+        self.alternative1 = alternative1
+        self.alternative2 = alternative2
+
+    def interpret(self, text, positions):
+        return (self.alternative1.interpret(text, positions)
+                | self.alternative2.interpret(text, positions))
+
+    def _to_nfa(self, nfa):
+        start, end = nfa.state(), nfa.state()
+        for alternative in (self.alternative1, self.alternative2):
+            inner_start, inner_end = alternative._to_nfa(nfa)
+            nfa.epsilon(start, inner_start)
+            nfa.epsilon(inner_end, end)
+        return start, end
+
+    def __repr__(self):
+        return "({!r} | {!r})".format(self.alternative1, self.alternative2)
+
+
+class SequenceExpression(RegularExpression):
+    def __init__(self, expression1, expression2):
+        self.expression1 = expression1
+        self.expression2 = expression2
+
+    def interpret(self, text, positions):
+        return self.expression2.interpret(
+            text, self.expression1.interpret(text, positions))
+
+    def _to_nfa(self, nfa):
+        start, middle = self.expression1._to_nfa(nfa)
+        inner_start, end = self.expression2._to_nfa(nfa)
+        nfa.epsilon(middle, inner_start)
+        return start, end
+
+    def __repr__(self):
+        return "({!r} + {!r})".format(self.expression1, self.expression2)
+
+
+class RepetitionExpression(RegularExpression):
+    """Zero or more repetitions of an expression"""
+
+    def __init__(self, repetition):
+        self.repetition = repetition
+
+    def interpret(self, text, positions):
+        reached = set(positions)
+        frontier = reached
+        while frontier:
+            frontier = self.repetition.interpret(text, frontier) - reached
+            reached |= frontier
+        return reached
+
+    def _to_nfa(self, nfa):
+        start = nfa.state()
+        inner_start, inner_end = self.repetition._to_nfa(nfa)
+        nfa.epsilon(start, inner_start)
+        nfa.epsilon(inner_end, start)
+        return start, start
+
+    def __repr__(self):
+        return "{!r}.repeat()".format(self.repetition)
+
+
+class _NFA:
+    """A Thompson NFA: numbered states with symbol and epsilon edges"""
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.edges = []
+        self.epsilons = []
+
+    def state(self):
+        self.edges.append({})
+        self.epsilons.append([])
+        return len(self.edges) - 1
+
+    def symbols(self, literal):
+        if self.binary and isinstance(literal, str):
+            literal = literal.encode("utf-8")
+        return list(literal)
+
+    def edge(self, state, symbol, following):
+        self.edges[state].setdefault(symbol, []).append(following)
+
+    def epsilon(self, state, following):
+        self.epsilons[state].append(following)
+
+    def closure(self, states):
+        stack = list(states)
+        reached = set(stack)
+        while stack:
+            for following in self.epsilons[stack.pop()]:
+                if following not in reached:
+                    reached.add(following)
+                    stack.append(following)
+        return frozenset(reached)
+
+
+class Automaton:
+    """ A compiled expression.
+
+    The NFA is turned into a DFA lazily: a DFA state is only built the
+    first time the input leads to it, then cached, so matching costs one
+    dict lookup per symbol once the cache is warm. The cache is dropped if
+    it grows past ``max_states``, which bounds memory for expressions whose
+    DFA would blow up.
+    """
+
+    #: The dead state, reached once no match is possible any more.
+    DEAD = 0
+
+    def __init__(self, nfa, start, end, max_states=10000, search=False):
+        self._nfa = nfa
+        self._start = nfa.closure([start])
+        self._end = end
+        self.max_states = max_states
+        self.search = search
+        self._reset()
+
+    def _reset(self):
+        self._ids = {frozenset(): self.DEAD}
+        self._sets = [frozenset()]
+        self._transitions = [{}]
+        self._accepting = [False]
+        self.start = self._state(self._start)
+
+    def _state(self, nfa_states):
+        state = self._ids.get(nfa_states)
+        if state is None:
+            state = len(self._sets)
+            self._ids[nfa_states] = state
+            self._sets.append(nfa_states)
+            self._transitions.append({})
+            self._accepting.append(self._end in nfa_states)
+        return state
+
+    def step(self, state, symbol):
+        """Return the DFA state reached from ``state`` on ``symbol``"""
+        try:
+            return self._transitions[state][symbol]
+        except KeyError:
+            pass
+        if len(self._sets) > self.max_states:
+            nfa_states = self._sets[state]
+            self._reset()
+            state = self._state(nfa_states)
+        edges = self._nfa.edges
+        following = []
+        for nfa_state in self._sets[state]:
+            following.extend(edges[nfa_state].get(symbol, ()))
+        following = self._nfa.closure(following)
+        if self.search:
+            following |= self._start
+        target = self._state(following)
+        self._transitions[state][symbol] = target
+        return target
+
+    def accepting(self, state):
+        return self._accepting[state]
+
+    def match(self, text):
+        """Whether the automaton matches the whole of ``text``"""
+        state = self.start
+        transitions = self._transitions
+        for symbol in text:
+            try:
+                state = transitions[state][symbol]
+            except KeyError:
+                state = self.step(state, symbol)
+                transitions = self._transitions
+            if state == self.DEAD:
+                return False
+        return self._accepting[state]
+
+    def __len__(self):
+        """The number of DFA states built so far"""
+        return len(self._sets)
+
+    def searcher(self):
+        """ An automaton for the same expression that may start matching at
+        any offset, for finding matches inside a larger input.
+        """
+        searcher = Automaton.__new__(Automaton)
+        searcher.__dict__.update(self.__dict__)
+        searcher.search = True
+        searcher._reset()
+        return searcher
+
+    def finditer(self, source, chunk_size=1 << 20):
+        """ Yield the offset just past the end of every match in
+        ``source``, a bytes-like object, mmap or binary file.
+
+        The input is read in chunks of ``chunk_size`` bytes and scanned
+        through memoryviews, so it is never copied into Python strings;
+        the matching state carries over from one chunk to the next, so
+        matches spanning a chunk boundary are found too. Only bytes
+        automata (``compile(binary=True)``) can scan binary sources.
+        """
+        if not self._nfa.binary:
+            raise TypeError("Compile with binary=True to scan bytes")
+        searcher = self if self.search else self.searcher()
+        accepting = searcher._accepting
+        state = searcher.start
+        if accepting[state]:
+            yield 0
+        offset = 0
+        for chunk in _chunks(source, chunk_size):
+            transitions = searcher._transitions
+            for symbol in chunk:
+                offset += 1
+                try:
+                    state = transitions[state][symbol]
+                except KeyError:
+                    state = searcher.step(state, symbol)
+                    transitions = searcher._transitions
+                    accepting = searcher._accepting
+                if accepting[state]:
+                    yield offset
+
+
+def _chunks(source, chunk_size):
+    """Yield memoryviews over consecutive chunks of a binary source"""
+    if hasattr(source, "readinto"):
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            size = source.readinto(buffer)
+            if not size:
+                return
+            yield view[:size]
+    else:
+        view = memoryview(source)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+
+
+def benchmark(size=2000):
+    """ Compare the tree-walking interpreter with the compiled automaton
+    on patterns that make the tree-walker revisit the same positions.
+    """
+    a = LiteralExpression("a")
+    patterns = {
+        "(a | aa)*": (a | "aa").repeat(),
+        "((a*)*)*": a.repeat().repeat().repeat(),
+        "(a | a)* b": (a | a).repeat() + "b",
+    }
+    text = "a" * size
+    for label, expression in patterns.items():
+        start = time.perf_counter()
+        walked = expression.match(text)
+        walking = time.perf_counter() - start
+        start = time.perf_counter()
+        automaton = expression.compile()
+        compiled = automaton.match(text)
+        compiling = time.perf_counter() - start
+        assert walked == compiled
+        print("{:<12} tree-walker {:8.1f}ms  automaton {:6.2f}ms".format(
+            label, walking * 1000, compiling * 1000))
+
+
+def _shards(mapped, shards):
+    """Split a mapping into up to ``shards`` line-aligned (start, stop)"""
+    size = len(mapped)
+    bounds = [0]
+    for i in range(1, shards):
+        cut = mapped.find(b"\n", max(size * i // shards, bounds[-1]))
+        if cut < 0:
+            break
+        if cut + 1 > bounds[-1]:
+            bounds.append(cut + 1)
+    bounds.append(size)
+    return [(start, stop) for start, stop in zip(bounds, bounds[1:])
+            if stop > start]
+
+
+_worker_automaton = None
+_worker_mapping = None
+
+
+def _init_worker(automaton, path):
+    import mmap
+
+    global _worker_automaton, _worker_mapping
+    _worker_automaton = automaton
+    with open(path, "rb") as f:
+        _worker_mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _search_shard(shard):
+    start, stop = shard
+    view = memoryview(_worker_mapping)[start:stop]
+    try:
+        # An empty match at a shard's start was already reported as the
+        # end of the previous shard.
+        return [start + offset
+                for offset in _worker_automaton.finditer(view)
+                if offset or not start]
+    finally:
+        view.release()
+
+
+def parallel_finditer(automaton, path, processes=None, shards=None):
+    """ Yield the end offsets of the matches in the file at ``path``, in
+    input order, searching line-aligned shards in a process pool.
+
+    The automaton is sent to each worker once, with the DFA states it has
+    built so far, rather than being recompiled per shard. Matches must not
+    span lines, since a shard boundary can fall between any two lines.
+    """
+    import mmap
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    processes = processes or os.cpu_count()
+    searcher = automaton if automaton.search else automaton.searcher()
+    if not os.path.getsize(path):
+        return
+    with open(path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        pieces = _shards(mapped, shards or processes * 4)
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(searcher, path)) as pool:
+        for offsets in pool.map(_search_shard, pieces):
+            yield from offsets
+
+
+def benchmark_parallel(megabytes=16, processes=None):
+    """Report how parallel_finditer scales from 1 to N processes"""
+    import os
+    import tempfile
+
+    automaton = (LiteralExpression("ERROR") + " disk full").compile(
+        binary=True)
+    line = b"INFO request served in 12ms\n" * 49 + b"ERROR disk full\n"
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "app.log")
+        with open(path, "wb") as f:
+            for _ in range(megabytes * 2 ** 20 // len(line)):
+                f.write(line)
+        size = os.path.getsize(path) / 2 ** 20
+        baseline = None
+        for count in range(1, (processes or os.cpu_count()) + 1):
+            start = time.perf_counter()
+            matches = sum(1 for _ in parallel_finditer(
+                automaton, path, processes=count))
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print("{:>2} processes: {} matches, {:.1f}MB/s, {:.2f}x".format(
+                count, matches, size / elapsed, baseline / elapsed))
+
+
+def benchmark_stream(megabytes=16):
+    """Measure the throughput of scanning a memory-mapped log file"""
+    import mmap
+    import os
+    import tempfile
+
+    level = LiteralExpression("ERROR") | "FATAL"
+    expression = level + " disk " + (LiteralExpression("full")
+                                     | "failed")
+    automaton = expression.compile(binary=True)
+    lines = [b"INFO request served in 12ms\n",
+             b"WARN cache miss for key 42\n",
+             b"ERROR disk full on /var\n",
+             b"FATAL disk failed, shutting down\n"]
+    block = b"".join(lines[i % 4] if i % 50 == 0 else lines[i % 2]
+                     for i in range(1000))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "app.log")
+        with open(path, "wb") as f:
+            for _ in range(megabytes * 2 ** 20 // len(block)):
+                f.write(block)
+        size = os.path.getsize(path)
+        with open(path, "rb") as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            start = time.perf_counter()
+            matches = sum(1 for _ in automaton.finditer(mapped))
+            elapsed = time.perf_counter() - start
+    print("{} matches in {:.1f}MB: {:.1f}MB/s".format(
+        matches, size / 2 ** 20, size / 2 ** 20 / elapsed))
+
+
+if __name__ == '__main__':
+    # raining & (dogs | cats) *
+    expression = "raining " + (LiteralExpression("dogs")
+                               | LiteralExpression("cats")).repeat()
+    automaton = expression.compile()
+    for sentence in ["raining catsdogs", "raining", "raining frogs"]:
+        print("{!r}: interpreted {}, compiled {}".format(
+            sentence, expression.match(sentence), automaton.match(sentence)))
@@ -0,0 +1,14 @@
+"""
+Creational Patterns
+===================
+"""
+
+from design_patterns import _lazy
+
+__getattr__, __dir__, __all__ = _lazy.attach(__name__, [
+    "abstract_factory",
+    "builder",
+    "factory_method",
+    "prototype",
+    "singleton",
+])
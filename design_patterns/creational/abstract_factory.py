@@ -41,7 +41,13 @@ Consequences
 4. Supporting new kinds of products is difficult.
 """
 
+import gc
+import importlib
 import random
+import time
+import weakref
+from collections import deque
+from functools import partial
 
 
 class FishShop:
@@ -86,6 +92,249 @@ def random_fish():
     return random.choice([Guppy, Betta])()
 
 
+class PooledFactory:
+    """ Wraps any factory callable with a pool of recycled products.
+
+    Released products are passed to the ``reset`` hook and handed out again
+    by later calls instead of allocating new instances. At most ``size``
+    idle products are kept.
+
+    By default the pool only counts products in use and trusts callers to
+    release what they acquired. With ``track_leaks`` every product handed
+    out is watched: releasing anything else raises KeyError, and a product
+    that is garbage collected without being released is counted as a leak.
+    Watching costs a weak reference with a callback per acquire.
+    """
+
+    def __init__(self, factory, size=64, reset=None, track_leaks=False):
+        if size < 0:
+            raise ValueError("Pool size must be non-negative")
+        self._factory = factory
+        self._reset = reset
+        self._track_leaks = track_leaks
+        self.size = size
+        self._idle = []
+        self._outstanding = {}
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.leaked = 0
+
+    def __call__(self):
+        return self.acquire()
+
+    def acquire(self):
+        """Hand out an idle product, or create one if the pool is empty"""
+        if self._idle:
+            product = self._idle.pop()
+            self.reused += 1
+        else:
+            product = self._factory()
+            self.created += 1
+        if self._track_leaks:
+            key = id(product)
+            self._outstanding[key] = weakref.ref(
+                product, partial(self._leak, key))
+        self.in_use += 1
+        return product
+
+    def release(self, product):
+        """Reset a product and return it to the pool"""
+        if self._track_leaks:
+            tracker = self._outstanding.get(id(product))
+            if tracker is None or tracker() is not product:
+                raise KeyError(
+                    "{} was not acquired from this pool".format(product))
+            del self._outstanding[id(product)]
+        self.in_use -= 1
+        if self._reset is not None:
+            self._reset(product)
+        if len(self._idle) < self.size:
+            self._idle.append(product)
+
+    def _leak(self, key, tracker):
+        if self._outstanding.get(key) is not tracker:
+            return
+        del self._outstanding[key]
+        self.in_use -= 1
+        self.leaked += 1
+
+
+class FamilyRegistry:
+    """ A registry of product families declared by dotted path.
+
+    A family is declared as ``"package.module:Name"`` (or
+    ``"package.module.Name"``) and is only imported the first time it is
+    asked for. The resolved constructor is then cached so later calls skip
+    the import machinery altogether.
+    """
+
+    def __init__(self):
+        self._paths = {}
+        self._constructors = {}
+
+    def register(self, name, path):
+        """Declare a family without importing it"""
+        self._paths[name] = path
+        self._constructors.pop(name, None)
+
+    def load_entry_points(self, group):
+        """Declare every family advertised under an entry point group"""
+        from importlib import metadata
+
+        for entry_point in metadata.entry_points(group=group):
+            self.register(entry_point.name, entry_point.value)
+
+    def unregister(self, name):
+        del self._paths[name]
+        self._constructors.pop(name, None)
+
+    def resolve(self, name):
+        """Import a family on first use and return its constructor"""
+        try:
+            return self._constructors[name]
+        except KeyError:
+            pass
+        path = self._paths[name]
+        if ":" in path:
+            module_name, _, attr = path.partition(":")
+        else:
+            module_name, _, attr = path.rpartition(".")
+        constructor = getattr(importlib.import_module(module_name), attr)
+        self._constructors[name] = constructor
+        return constructor
+
+    def __call__(self, name):
+        return self.resolve(name)()
+
+    def __contains__(self, name):
+        return name in self._paths
+
+    def loaded(self):
+        """Names of the families imported so far"""
+        return list(self._constructors)
+
+
+def _gc_pauses(run):
+    """ Run a workload and return its duration, the collections it
+    triggered and the total time spent inside the garbage collector.
+    """
+    pauses = []
+    started = {}
+
+    def callback(phase, info):
+        if phase == "start":
+            started["t"] = time.perf_counter()
+        else:
+            pauses.append(time.perf_counter() - started["t"])
+
+    gc.collect()
+    gc.callbacks.append(callback)
+    try:
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+    finally:
+        gc.callbacks.remove(callback)
+    return elapsed, len(pauses), sum(pauses)
+
+
+def _listed_fish():
+    """ A pet with a shop listing that refers back to it. The cycle means
+    only the garbage collector can free a pet that is thrown away.
+    """
+    fish = random_fish()
+    fish.listing = {"fish": fish, "notes": []}
+    return fish
+
+
+def _unlist(fish):
+    fish.listing["notes"].clear()
+
+
+def benchmark(n=1000000, live=100):
+    """ Compare allocating pets with recycling them through a pool.
+
+    ``live`` pets are held at any time, as a shop holding a small stock
+    that turns over constantly. Each pet is listed, see _listed_fish, so
+    discarded pets are left for the garbage collector.
+    """
+    def allocating():
+        stock = deque()
+        for _ in range(n):
+            stock.append(_listed_fish())
+            if len(stock) > live:
+                stock.popleft()
+
+    pools = {
+        "pooled": PooledFactory(_listed_fish, size=live, reset=_unlist),
+        "tracked": PooledFactory(_listed_fish, size=live, reset=_unlist,
+                                 track_leaks=True),
+    }
+
+    def pooled(pool):
+        def run():
+            stock = deque()
+            for _ in range(n):
+                stock.append(pool())
+                if len(stock) > live:
+                    pool.release(stock.popleft())
+        return run
+
+    runs = [("allocating", allocating)]
+    runs.extend((label, pooled(pool)) for label, pool in pools.items())
+    for label, run in runs:
+        elapsed, collections, paused = _gc_pauses(run)
+        print("{:<10} {:.2f}s, {} collections, {:.1f}ms in gc".format(
+            label, elapsed, collections, paused * 1000))
+    for label, pool in pools.items():
+        print("{} pool created {} pets, reused {}".format(
+            label, pool.created, pool.reused))
+
+
+def benchmark_registry(families=500):
+    """ Compare eagerly importing every family with declaring them all in a
+    registry and only using one of them.
+    """
+    import os
+    import sys
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as package_dir:
+        names = ["bench_family_{}".format(i) for i in range(families)]
+        for name in names:
+            with open(os.path.join(package_dir, name + ".py"), "w") as f:
+                f.write(
+                    "import random\n\n\n"
+                    "class Fish:\n"
+                    "    colours = ['red', 'gold']\n\n"
+                    "    @property\n"
+                    "    def colour(self):\n"
+                    "        return random.choice(self.colours)\n"
+                )
+        sys.path.insert(0, package_dir)
+        try:
+            start = time.perf_counter()
+            for name in names:
+                importlib.import_module(name)
+            eager = time.perf_counter() - start
+            for name in names:
+                del sys.modules[name]
+
+            start = time.perf_counter()
+            registry = FamilyRegistry()
+            for name in names:
+                registry.register(name, name + ":Fish")
+            registry(names[0])
+            lazy = time.perf_counter() - start
+            del sys.modules[names[0]]
+        finally:
+            sys.path.remove(package_dir)
+    print("eager import of {} families: {:.1f}ms".format(
+        families, eager * 1000))
+    print("lazy registry, one family used: {:.1f}ms".format(lazy * 1000))
+
+
 if __name__ == "__main__":
     # A shop that sells only guppies
     guppy_shop = FishShop(Guppy)
@@ -97,3 +346,18 @@ if __name__ == "__main__":
     for _ in range(3):
         fish_shop.show_pet()
         print("=" * 20)
+
+    # A shop recycling the pets it sells
+    pool = PooledFactory(random_fish, size=2, track_leaks=True)
+    pooled_shop = FishShop(pool)
+    pooled_shop.show_pet()
+    print("{} pets in use, {} leaked".format(pool.in_use, pool.leaked))
+    print("")
+
+    # A shop whose families are only imported when first sold
+    families = FamilyRegistry()
+    families.register("guppy", __name__ + ":Guppy")
+    families.register("betta", __name__ + ":Betta")
+    lazy_shop = FishShop(lambda: families("betta"))
+    lazy_shop.show_pet()
+    print("Loaded families: {}".format(families.loaded()))
@@ -37,6 +37,8 @@ Consequences
 """
 
 import random
+import time
+from array import array
 
 
 # Abstract Builder
@@ -112,6 +114,197 @@ def construct_monster(cls):
     return monster
 
 
+def build_variants(cls):
+    """ Run a class's build steps once per entry in its ``descriptions``,
+    on blank instances that skip the usual constructor, and return the
+    attributes each variant ends up with.
+    """
+    variants = []
+    for description in cls.descriptions:
+        scratch = object.__new__(cls)
+        scratch.descriptions = [description]
+        scratch.give_description()
+        scratch.give_equipment()
+        del scratch.descriptions
+        variants.append(scratch.__dict__)
+    return variants
+
+
+class _VariantCache:
+    """ Caches a value derived from each class's ``descriptions``.
+
+    The value is rebuilt when ``descriptions`` is replaced or edited in
+    place. Checking costs an identity test and a comparison against a
+    private copy of the list, which for short lists of interned strings
+    stops at the identical first element of each pair.
+    """
+
+    def __init__(self, derive):
+        self._derive = derive
+        self._cache = {}
+
+    def get(self, cls):
+        descriptions = cls.descriptions
+        cached = self._cache.get(cls)
+        if (cached is not None and cached[0] is descriptions
+                and cached[1] == descriptions):
+            return cached[2]
+        value = self._derive(cls)
+        self._cache[cls] = descriptions, list(descriptions), value
+        return value
+
+    def invalidate(self, cls=None):
+        """Drop the value of one class, or of every class"""
+        if cls is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(cls, None)
+
+
+class MonsterTemplates(_VariantCache):
+    """ Caches the fully built attributes per class and description variant.
+
+    Monsters are produced by copying a variant's attributes into a blank
+    instance instead of running the build steps again. A class's templates
+    are rebuilt whenever its ``descriptions`` change.
+    """
+
+    def __init__(self):
+        super().__init__(build_variants)
+
+    def construct(self, cls):
+        variants = self.get(cls)
+        monster = object.__new__(cls)
+        monster.__dict__.update(variants[int(random.random() * len(variants))])
+        return monster
+
+
+_templates = MonsterTemplates()
+
+construct_cached_monster = _templates.construct
+
+
+def benchmark_templates(count=200000, repeat=5):
+    """ Compare construct_monster throughput with template cloning, taking
+    the best of ``repeat`` runs.
+    """
+    for label, construct in (("construct_monster", construct_monster),
+                             ("templates", construct_cached_monster)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(count):
+                construct(ComplexDragon)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("{:<17} {:,.0f} monsters/s".format(label, count / best))
+
+
+class MonsterRow:
+    """ A lightweight view of one monster stored in a MonsterTable."""
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    @property
+    def description(self):
+        table = self._table
+        return table.strings[table.descriptions[self._index]]
+
+    @property
+    def equipment(self):
+        table = self._table
+        return table.strings[table.equipment[self._index]]
+
+    def __repr__(self):
+        return "{0.description} | Wielding: {0.equipment}".format(self)
+
+
+class MonsterTable:
+    """ A bulk builder storing monsters column by column.
+
+    Every description and piece of equipment a class can produce is built
+    once into a shared string table; each monster is then just a pair of
+    ids into that table. Rows are only materialised as MonsterRow views
+    when they are accessed.
+    """
+
+    def __init__(self):
+        self.strings = []
+        self._string_ids = {}
+        self._parts = _VariantCache(self._build_parts)
+        self.descriptions = array("I")
+        self.equipment = array("I")
+
+    def _intern(self, string):
+        try:
+            return self._string_ids[string]
+        except KeyError:
+            self._string_ids[string] = len(self.strings)
+            self.strings.append(string)
+            return self._string_ids[string]
+
+    def _build_parts(self, cls):
+        variants = build_variants(cls)
+        description_ids = [self._intern(variant["description"])
+                           for variant in variants]
+        return description_ids, self._intern(variants[0]["equipment"])
+
+    def build(self, cls, count):
+        """Append ``count`` monsters of ``cls`` in one pass"""
+        description_ids, equipment_id = self._parts.get(cls)
+        self.descriptions.extend(random.choices(description_ids, k=count))
+        self.equipment.extend(array("I", [equipment_id]) * count)
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("monster index out of range")
+        return MonsterRow(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield MonsterRow(self, index)
+
+
+def benchmark(count=1000000):
+    """Compare building monsters one by one against a MonsterTable"""
+    import tracemalloc
+
+    makers = {
+        Orc: Orc,
+        Goblin: Goblin,
+        ComplexDragon: lambda: construct_monster(ComplexDragon),
+    }
+    per_class = count // len(makers)
+
+    def one_by_one():
+        return [make() for make in makers.values() for _ in range(per_class)]
+
+    def columnar():
+        table = MonsterTable()
+        for cls in makers:
+            table.build(cls, per_class)
+        return table
+
+    for label, run in (("objects", one_by_one), ("columnar", columnar)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        monsters = run()
+        elapsed = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("{:<8} {} monsters in {:.2f}s using {:.1f}MB".format(
+            label, len(monsters), elapsed, memory / 2 ** 20))
+        del monsters
+
+
 # Client
 if __name__ == "__main__":
     orc = Orc()
@@ -123,3 +316,13 @@ if __name__ == "__main__":
     # Using an external constructor function:
     complex_dragon = construct_monster(ComplexDragon)
     print(complex_dragon)
+
+    # Cloning a cached template:
+    print(construct_cached_monster(ComplexDragon))
+
+    # Building a horde in bulk:
+    horde = MonsterTable()
+    horde.build(Orc, 2)
+    horde.build(ComplexDragon, 1)
+    for monster in horde:
+        print(monster)
@@ -66,23 +66,117 @@ class AttackMethod:
         return base_damage
 
 
+class AttackStrategy:
+    """ A stateless attack for one (strength, weapon_type) pair.
+
+    Strategies are shared between every monster with the same pair, see
+    ``attack_strategy``.
+    """
+    __slots__ = ("verb", "weapon_type", "_method")
+
+    def __init__(self, method, strength, weapon_type):
+        self.verb = method.get(strength)
+        self.weapon_type = weapon_type
+        self._method = method
+
+    def damage(self, base_damage):
+        return self._method.damage(base_damage, self.weapon_type)
+
+
+_attack_method = AttackMethod()
+_strategies = {}
+
+
+def attack_strategy(strength, weapon_type):
+    """Return the shared strategy for a strength and weapon type"""
+    key = (strength, weapon_type)
+    try:
+        return _strategies[key]
+    except KeyError:
+        strategy = AttackStrategy(_attack_method, strength, weapon_type)
+        _strategies[key] = strategy
+        return strategy
+
+
 class Monster:
 
     def __init__(self, name, strength, weapon_type):
         self.name = name
-        self.strength = strength
-        self.weapon_type = weapon_type
+        self._strength = strength
+        self._weapon_type = weapon_type
+        self._strategy = attack_strategy(strength, weapon_type)
+
+    @property
+    def strength(self):
+        return self._strength
+
+    @strength.setter
+    def strength(self, strength):
+        self._strength = strength
+        self._strategy = attack_strategy(strength, self._weapon_type)
+
+    @property
+    def weapon_type(self):
+        return self._weapon_type
+
+    @weapon_type.setter
+    def weapon_type(self, weapon_type):
+        self._weapon_type = weapon_type
+        self._strategy = attack_strategy(self._strength, weapon_type)
 
     def attack(self, damage):
-        attack = AttackMethod()
-        attack_type = attack.get(self.strength)
-        damage = attack.damage(damage, self.weapon_type)
-        return "{} {} for {} damage.".format(self.name, attack_type, damage)
+        strategy = self._strategy
+        return "{} {} for {} damage.".format(
+            self.name, strategy.verb, strategy.damage(damage))
+
+
+class CombatLog:
+    """ The messages for a batch of attacks, formatted only when read."""
+
+    def __init__(self, names, verbs, damages):
+        self._names = names
+        self._verbs = verbs
+        self._damages = damages
+
+    def __len__(self):
+        return len(self._damages)
+
+    def __getitem__(self, index):
+        return "{} {} for {} damage.".format(
+            self._names[index], self._verbs[index], self._damages[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __str__(self):
+        return "\n".join(self)
+
+
+def resolve_attacks(monsters, base_damages):
+    """ Resolve a batch of attacks.
+
+    Returns the damage dealt by each monster and a CombatLog describing
+    the attacks.
+    """
+    if len(monsters) != len(base_damages):
+        raise ValueError("Expected one base damage per monster")
+    strategies = [monster._strategy for monster in monsters]
+    damages = [strategy.damage(base_damage)
+               for strategy, base_damage in zip(strategies, base_damages)]
+    log = CombatLog([monster.name for monster in monsters],
+                    [strategy.verb for strategy in strategies],
+                    damages)
+    return damages, log
 
 
-weak_monster = Monster("Goblin", "weak", weapon_type="rare")
-print(weak_monster.attack(2))
+if __name__ == "__main__":
+    weak_monster = Monster("Goblin", "weak", weapon_type="rare")
+    print(weak_monster.attack(2))
 
-strong_monster = Monster("Dragon", "strong", weapon_type="common")
-print(strong_monster.attack(5))
+    strong_monster = Monster("Dragon", "strong", weapon_type="common")
+    print(strong_monster.attack(5))
 
+    damages, log = resolve_attacks([weak_monster, strong_monster], [3, 4])
+    print(damages)
+    print(log)
@@ -51,6 +51,25 @@ Consequences
 5. Configuring an application with classes dynamically.
 """
 
+import bisect
+import math
+import mmap
+import random
+import struct
+import sys
+import threading
+import time
+import weakref
+from types import MappingProxyType
+
+
+#: Probability of finding a weapon of each known rarity.
+RARITY_PROBABILITY = MappingProxyType({
+    "common": 0.8,
+    "uncommon": 0.4,
+    "rare": 0.05,
+})
+
 
 # Abstract Prototype
 class WeaponType:
@@ -64,18 +83,20 @@ class WeaponType:
         obj.prob = self.determine_probability(obj)
         return obj
 
+    def cow_clone(self, **attrs):
+        """ Clone without copying, see WeaponClone."""
+        return WeaponClone(_frozen_state(self), attrs, type(self))
+
     @classmethod
     def determine_probability(self, obj):
         """ Calculate the probability of finding a weapon according
         to it's rarity.
         This assumes every weapon type should have a probability.
         """
-        if obj.rarity == "common":
-            return 0.8
-        if obj.rarity == "uncommon":
-            return 0.4
-        if obj.rarity == "rare":
-            return 0.05
+        try:
+            return RARITY_PROBABILITY[obj.rarity]
+        except KeyError:
+            pass
 
         if not hasattr(obj, "prob"):
             raise KeyError("Rarity not defined, please provide a prob")
@@ -83,6 +104,186 @@ class WeaponType:
             return obj.prob
 
 
+_frozen_states = weakref.WeakKeyDictionary()
+
+
+def _frozen_state(prototype):
+    """ The read-only state of a prototype, shared by all of its
+    copy-on-write clones.
+
+    The state is taken again whenever the prototype has changed since it
+    was last cloned, so a clone always copies the prototype as it is now.
+    Earlier clones keep the state they were cloned from.
+    """
+    source = vars(prototype)
+    cached = _frozen_states.get(prototype)
+    if (cached is not None and cached[0] == source
+            and cached[1] == (prototype.name, prototype.rarity)):
+        return cached[2]
+    state = {"name": prototype.name, "rarity": prototype.rarity}
+    state.update(source)
+    if prototype.rarity in RARITY_PROBABILITY or "prob" in state:
+        state["prob"] = prototype.determine_probability(prototype)
+    state = MappingProxyType(state)
+    _frozen_states[prototype] = (
+        dict(source), (prototype.name, prototype.rarity), state)
+    return state
+
+
+class WeaponClone:
+    """ A copy-on-write clone of a WeaponType.
+
+    The clone keeps a reference to its prototype's frozen state and a dict
+    of its own overrides, which is only allocated when the clone differs
+    from its prototype. Attribute writes always go to the overrides.
+    Anything else, such as methods, is looked up on the prototype's class,
+    which the clone also reports as its ``__class__``. Special methods and
+    other dunder attributes are not looked up on the prototype's class.
+    """
+    __slots__ = ("_base", "_overrides", "_type")
+
+    def __init__(self, base, attrs, cls=WeaponType):
+        object.__setattr__(self, "_base", base)
+        object.__setattr__(self, "_overrides", None)
+        object.__setattr__(self, "_type", cls)
+        for key, value in attrs.items():
+            setattr(self, key, value)
+        if "rarity" in attrs or "prob" in attrs:
+            if self.rarity in RARITY_PROBABILITY:
+                self.prob = RARITY_PROBABILITY[self.rarity]
+            elif "prob" not in attrs:
+                raise KeyError("Rarity not defined, please provide a prob")
+
+    def __getattr__(self, key):
+        overrides = self._overrides
+        if overrides is not None and key in overrides:
+            return overrides[key]
+        try:
+            return self._base[key]
+        except KeyError:
+            pass
+        if key.startswith("__"):
+            raise AttributeError(key)
+        value = getattr(self._type, key)
+        if hasattr(value, "__get__"):
+            return value.__get__(self, self._type)
+        return value
+
+    @property
+    def __class__(self):
+        return self._type
+
+    def __setattr__(self, key, value):
+        if key in self._base and self._base[key] == value:
+            if self._overrides is not None:
+                self._overrides.pop(key, None)
+            return
+        if self._overrides is None:
+            object.__setattr__(self, "_overrides", {})
+        self._overrides[key] = value
+
+    def __delattr__(self, key):
+        if self._overrides is None or key not in self._overrides:
+            raise AttributeError(key)
+        del self._overrides[key]
+
+    def clone(self, **attrs):
+        if self._overrides:
+            attrs = dict(self._overrides, **attrs)
+        return WeaponClone(self._base, attrs, self._type)
+
+    cow_clone = clone
+
+    def overrides(self):
+        """The attributes this clone does not share with its prototype"""
+        return dict(self._overrides or {})
+
+
+def clone_sizes(count=100000):
+    """Compare the memory held by plain and copy-on-write clones"""
+    prototype = WeaponType().clone(name="steel", rarity="rare")
+
+    def size(obj):
+        total = sys.getsizeof(obj)
+        if hasattr(obj, "__dict__"):
+            total += sys.getsizeof(obj.__dict__)
+        elif obj._overrides is not None:
+            total += sys.getsizeof(obj._overrides)
+        return total
+
+    plain = [prototype.clone(name="steel", rarity="rare")
+             for _ in range(count)]
+    shared = [prototype.cow_clone() for _ in range(count)]
+    print("plain clones:         {} bytes each".format(size(plain[0])))
+    print("copy-on-write clones: {} bytes each".format(size(shared[0])))
+
+
+class AliasTable:
+    """ Walker's alias method for drawing indexes in proportion to a list of
+    weights. Building the table is O(n), each draw is O(1).
+    """
+
+    #: Draws at or above this size use NumPy when it is installed.
+    VECTORIZE_ABOVE = 1024
+
+    def __init__(self, weights):
+        n = len(weights)
+        if n == 0:
+            raise ValueError("Cannot sample from an empty registry")
+        total = float(sum(weights))
+        if total <= 0:
+            raise ValueError("Weights must sum to a positive number")
+        scaled = [weight * n / total for weight in weights]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, weight in enumerate(scaled) if weight < 1.0]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        self._arrays = None
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self, k, rng=random):
+        """Return ``k`` indexes
+
+        Large draws seed NumPy's generator from ``rng``, so the same ``rng``
+        state always gives the same indexes, though not the ones the pure
+        Python loop would give.
+        """
+        if k >= self.VECTORIZE_ABOVE and hasattr(rng, "getrandbits"):
+            try:
+                return self._draw_numpy(k, rng.getrandbits(64))
+            except ImportError:
+                pass
+        n = len(self.prob)
+        prob, alias = self.prob, self.alias
+        indexes = []
+        for _ in range(k):
+            u = rng.random() * n
+            i = int(u)
+            indexes.append(i if u - i < prob[i] else alias[i])
+        return indexes
+
+    def _draw_numpy(self, k, seed):
+        import numpy
+
+        if self._arrays is None:
+            self._arrays = numpy.array(self.prob), numpy.array(self.alias)
+        prob, alias = self._arrays
+        u = numpy.random.default_rng(seed).random(k) * len(prob)
+        i = u.astype(numpy.intp)
+        return numpy.where(u - i < prob[i], i, alias[i]).tolist()
+
+
 class TypeRegistry:
     """ aka Dispatcher, aka Manager.
     When the number of prototypes in a system isn't fixed, keep a registry of
@@ -92,18 +293,443 @@ class TypeRegistry:
     """
     def __init__(self):
         self._objects = {}
+        self._alias_table = None
+        #: rarity -> {name: obj}
+        self._by_rarity = {}
+        #: (prob, name) pairs kept sorted
+        self._by_prob = []
+        #: name -> (rarity, prob) as indexed at registration
+        self._indexed = {}
 
     def get_objects(self):
         """Get all objects"""
         return self._objects
 
     def register_object(self, name, obj):
-        """Register an object"""
+        """ Register an object. It is indexed by the ``rarity`` and ``prob``
+        it has now, objects without them are left out of those indexes.
+        """
+        rarity = getattr(obj, "rarity", None)
+        prob = getattr(obj, "prob", None)
+        # Everything that can fail runs before the registry is changed
+        hash(rarity)
+        if prob is not None:
+            bisect.insort(self._by_prob, (prob, name))
+        if name in self._objects:
+            self.unregister_object(name)
         self._objects[name] = obj
+        self._alias_table = None
+        if rarity is not None:
+            self._by_rarity.setdefault(rarity, {})[name] = obj
+        self._indexed[name] = rarity, prob
 
     def unregister_object(self, name):
         """Unregister an object"""
+        rarity, prob = self._indexed[name]
+        if prob is not None:
+            index = bisect.bisect_left(self._by_prob, (prob, name))
+            if self._by_prob[index:index + 1] != [(prob, name)]:
+                raise RuntimeError(
+                    "prob index is missing {!r}".format(name))
+            del self._by_prob[index]
+        if rarity is not None:
+            objects = self._by_rarity[rarity]
+            del objects[name]
+            if not objects:
+                del self._by_rarity[rarity]
+        del self._indexed[name]
         del self._objects[name]
+        self._alias_table = None
+
+    def get_by_rarity(self, rarity):
+        """Get the objects of one rarity"""
+        return dict(self._by_rarity.get(rarity, {}))
+
+    def get_by_prob(self, low=0.0, high=1.0):
+        """Get the objects whose prob lies within ``[low, high]``, in order
+        of increasing prob.
+        """
+        start = bisect.bisect_left(self._by_prob, (low,))
+        above = math.nextafter(high, math.inf)
+        stop = bisect.bisect_left(self._by_prob, (above,))
+        return [self._objects[name] for _, name in self._by_prob[start:stop]]
+
+    def sample(self, k=1, rng=random):
+        """ Draw ``k`` clones of the prototypes that have a ``prob``, each
+        weighted by it. Prototypes are cloned with ``cow_clone`` when they
+        have one and with ``clone`` otherwise. The alias table is rebuilt
+        on the first draw after the registry changes.
+        """
+        if self._alias_table is None:
+            prototypes = [obj for obj in self._objects.values()
+                          if hasattr(obj, "prob")]
+            table = AliasTable([obj.prob for obj in prototypes])
+            clones = [getattr(obj, "cow_clone", None) or obj.clone
+                      for obj in prototypes]
+            self._alias_table = clones, table
+        clones, table = self._alias_table
+        return [clones[i]() for i in table.draw(k, rng)]
+
+
+def benchmark_queries(count=100000, repeat=100):
+    """Compare index queries with scanning every registered prototype"""
+    prototype = WeaponType()
+    rarities = ["common", "uncommon", "rare", "godlike"]
+    registry = TypeRegistry()
+    start = time.perf_counter()
+    for i in range(count):
+        rarity = rarities[i % len(rarities)]
+        weapon = prototype.cow_clone(name="weapon-{}".format(i), rarity=rarity,
+                                     prob=random.random())
+        registry.register_object(weapon.name, weapon)
+    print("registered {} prototypes in {:.2f}s".format(
+        count, time.perf_counter() - start))
+
+    objects = registry.get_objects()
+    queries = (
+        ("rarity scan", lambda: [o for o in objects.values()
+                                 if o.rarity == "godlike"]),
+        ("rarity index", lambda: registry.get_by_rarity("godlike")),
+        ("prob scan", lambda: [o for o in objects.values()
+                               if 0.004 <= o.prob <= 0.006]),
+        ("prob index", lambda: registry.get_by_prob(0.004, 0.006)),
+    )
+    for label, query in queries:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            found = query()
+        elapsed = (time.perf_counter() - start) / repeat
+        print("{:<12} {:>6} hits {:8.3f}ms".format(
+            label, len(found), elapsed * 1000))
+
+
+class ConcurrentTypeRegistry:
+    """ A TypeRegistry for many reader threads and few writers.
+
+    Readers use the current snapshot, an immutable mapping, without taking
+    a lock. Writers serialise on a lock, copy the snapshot, apply their
+    change and publish the copy with a single attribute assignment, so a
+    reader always sees either the whole change or none of it.
+    """
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        self._snapshot = MappingProxyType({})
+
+    def get_objects(self):
+        """Get an immutable snapshot of all objects"""
+        return self._snapshot
+
+    def get_object(self, name):
+        return self._snapshot[name]
+
+    def register_object(self, name, obj):
+        """Register an object"""
+        self.register_objects({name: obj})
+
+    def register_objects(self, objects):
+        """Register many objects, publishing a single snapshot"""
+        with self._write_lock:
+            snapshot = dict(self._snapshot)
+            snapshot.update(objects)
+            self._snapshot = MappingProxyType(snapshot)
+
+    def unregister_object(self, name):
+        """Unregister an object"""
+        with self._write_lock:
+            snapshot = dict(self._snapshot)
+            del snapshot[name]
+            self._snapshot = MappingProxyType(snapshot)
+
+
+class _LockedTypeRegistry(TypeRegistry):
+    """A TypeRegistry guarded by one lock, for comparison"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def get_object(self, name):
+        with self._lock:
+            return self._objects[name]
+
+    def register_object(self, name, obj):
+        with self._lock:
+            super().register_object(name, obj)
+
+
+def benchmark_concurrent_reads(threads=(1, 2, 4, 8), duration=0.5,
+                               count=1000):
+    """ Compare lookups per second across reader threads, while a writer
+    keeps registering new prototypes, for a single-lock registry and the
+    snapshot registry.
+    """
+    prototype = WeaponType()
+    names = ["weapon-{}".format(i) for i in range(count)]
+
+    for registry_cls in (_LockedTypeRegistry, ConcurrentTypeRegistry):
+        for reader_count in threads:
+            registry = registry_cls()
+            for name in names:
+                registry.register_object(name, prototype.cow_clone(name=name))
+            stop = threading.Event()
+            reads = [0] * reader_count
+
+            def read(slot):
+                done = 0
+                get_object = registry.get_object
+                while not stop.is_set():
+                    for name in names:
+                        get_object(name)
+                    done += count
+                reads[slot] = done
+
+            def write():
+                i = 0
+                while not stop.is_set():
+                    name = "new-{}".format(i)
+                    registry.register_object(name, prototype.cow_clone())
+                    i += 1
+                    time.sleep(0.001)
+
+            workers = [threading.Thread(target=read, args=(slot,))
+                       for slot in range(reader_count)]
+            workers.append(threading.Thread(target=write))
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            time.sleep(duration)
+            stop.set()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+            print("{:<22} {} readers {:>12,.0f} reads/s".format(
+                registry_cls.__name__, reader_count, sum(reads) / elapsed))
+
+
+# Registry snapshots
+#
+# header   magic, version, rarity count, record count and the offsets of
+#          the three sections below
+# rarities length-prefixed UTF-8 rarity names, referenced by code
+# records  fixed-width records sorted by name: name offset and length,
+#          rarity code, prob, override offset and length
+# blob     UTF-8 names and JSON encoded override attributes
+
+_SNAPSHOT_MAGIC = b"WREG"
+_SNAPSHOT_VERSION = 1
+_HEADER = struct.Struct("<4sHHIQQQ")
+_RECORD = struct.Struct("<QHHdQI")
+_LENGTH = struct.Struct("<H")
+
+
+def _override_attrs(obj, name):
+    """ The attributes to store for ``obj``, except those the record holds.
+    ``name`` is left out when it matches the registry key.
+    """
+    if isinstance(obj, WeaponClone):
+        attrs = dict(obj._base)
+        attrs.update(obj.overrides())
+    else:
+        attrs = dict(vars(obj))
+        attrs["name"] = obj.name
+    attrs.pop("rarity", None)
+    attrs.pop("prob", None)
+    if attrs.get("name") == name:
+        del attrs["name"]
+    return attrs
+
+
+def save_snapshot(registry, path):
+    """ Write a registry's prototypes to ``path``. Their attributes must be
+    JSON serialisable. A copy-on-write clone is stored with the state it
+    inherits from its prototype, so it restores without that prototype.
+    """
+    import json
+
+    rarity_codes = {}
+    records = []
+    blob = bytearray()
+    for name, obj in sorted(registry.get_objects().items(),
+                            key=lambda item: item[0].encode("utf-8")):
+        code = rarity_codes.setdefault(obj.rarity, len(rarity_codes))
+        encoded_name = name.encode("utf-8")
+        name_offset = len(blob)
+        blob += encoded_name
+        attrs = _override_attrs(obj, name)
+        attrs_offset = len(blob)
+        if attrs:
+            blob += json.dumps(attrs, separators=(",", ":")).encode("utf-8")
+        records.append(_RECORD.pack(
+            name_offset, len(encoded_name), code, obj.prob,
+            attrs_offset, len(blob) - attrs_offset))
+
+    rarities = bytearray()
+    for rarity in rarity_codes:
+        encoded = rarity.encode("utf-8")
+        rarities += _LENGTH.pack(len(encoded)) + encoded
+
+    rarities_offset = _HEADER.size
+    records_offset = rarities_offset + len(rarities)
+    blob_offset = records_offset + _RECORD.size * len(records)
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(
+            _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, len(rarity_codes),
+            len(records), rarities_offset, records_offset, blob_offset))
+        f.write(rarities)
+        f.writelines(records)
+        f.write(blob)
+
+
+class SnapshotRegistry:
+    """ A read-only registry memory mapped from a snapshot file.
+
+    Opening it only reads the header and rarity table. Lookups binary
+    search the sorted records in the mapping and materialise a
+    copy-on-write clone of ``prototype`` for the entry found.
+    """
+
+    def __init__(self, path, prototype=None):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, rarity_count, self._count, rarities_offset,
+         self._records_offset, self._blob_offset) = _HEADER.unpack_from(
+            self._map)
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError("{} is not a registry snapshot".format(path))
+        self._rarities = []
+        offset = rarities_offset
+        for _ in range(rarity_count):
+            (length,) = _LENGTH.unpack_from(self._map, offset)
+            offset += _LENGTH.size
+            self._rarities.append(
+                self._map[offset:offset + length].decode("utf-8"))
+            offset += length
+        prototype = prototype or WeaponType()
+        self._base = _frozen_state(prototype)
+        self._type = type(prototype)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, index):
+        return _RECORD.unpack_from(
+            self._map, self._records_offset + index * _RECORD.size)
+
+    def _name(self, record):
+        start = self._blob_offset + record[0]
+        return self._map[start:start + record[1]]
+
+    def _find(self, name):
+        key = name.encode("utf-8")
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(self._record(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count:
+            record = self._record(low)
+            if self._name(record) == key:
+                return record
+        return None
+
+    def _materialise(self, record):
+        import json
+
+        _, _, code, prob, attrs_offset, attrs_length = record
+        overrides = {"name": self._name(record).decode("utf-8")}
+        if attrs_length:
+            start = self._blob_offset + attrs_offset
+            overrides.update(json.loads(
+                self._map[start:start + attrs_length]))
+        overrides["rarity"] = self._rarities[code]
+        overrides["prob"] = prob
+        obj = WeaponClone.__new__(WeaponClone)
+        object.__setattr__(obj, "_base", self._base)
+        object.__setattr__(obj, "_overrides", overrides)
+        object.__setattr__(obj, "_type", self._type)
+        return obj
+
+    def __contains__(self, name):
+        return self._find(name) is not None
+
+    def get_object(self, name):
+        """Materialise one prototype"""
+        record = self._find(name)
+        if record is None:
+            raise KeyError(name)
+        return self._materialise(record)
+
+    def names(self):
+        for index in range(self._count):
+            yield self._name(self._record(index)).decode("utf-8")
+
+    def get_objects(self):
+        """Materialise every prototype"""
+        objects = {}
+        for index in range(self._count):
+            record = self._record(index)
+            name = self._name(record).decode("utf-8")
+            objects[name] = self._materialise(record)
+        return objects
+
+    def to_registry(self):
+        """Load every prototype into a mutable TypeRegistry"""
+        registry = TypeRegistry()
+        for name, obj in self.get_objects().items():
+            registry.register_object(name, obj)
+        return registry
+
+
+def benchmark_snapshot(count=50000, lookups=100):
+    """Compare rebuilding a registry with restoring it from a snapshot"""
+    import os
+    import tempfile
+
+    def build():
+        prototype = WeaponType()
+        registry = TypeRegistry()
+        for i in range(count):
+            weapon = prototype.clone(name="weapon-{}".format(i),
+                                     rarity="godlike", prob=i / count)
+            registry.register_object(weapon.name, weapon)
+        return registry
+
+    start = time.perf_counter()
+    registry = build()
+    rebuild = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "registry.snapshot")
+        save_snapshot(registry, path)
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        with SnapshotRegistry(path) as snapshot:
+            for i in range(lookups):
+                snapshot.get_object("weapon-{}".format(i * count // lookups))
+            restore = time.perf_counter() - start
+            start = time.perf_counter()
+            snapshot.get_objects()
+            materialise = time.perf_counter() - start
+
+    print("rebuild {} prototypes:         {:8.1f}ms".format(
+        count, rebuild * 1000))
+    print("restore + {} lookups:         {:8.1f}ms".format(
+        lookups, restore * 1000))
+    print("restore and materialise all:  {:8.1f}ms".format(
+        (restore + materialise) * 1000))
+    print("snapshot size: {:.1f} bytes per prototype".format(size / count))
 
 
 def main():
@@ -133,6 +759,21 @@ def main():
     )
     registry.register_object(diamond_weapons.name, diamond_weapons)
 
+    # Copy-on-write clones only store what differs from their prototype
+    rusty_steel = steel_weapons.cow_clone()
+    rusty_steel.name = "rusty steel"
+    print("Rusty steel overrides {}".format(rusty_steel.overrides()))
+
+    # Querying the registry's indexes
+    print("Common weapons: {}".format(
+        ", ".join(registry.get_by_rarity("common"))))
+    print("Weapons rarer than 10%: {}".format(
+        ", ".join(weapon.name for weapon in registry.get_by_prob(high=0.1))))
+
+    # Rolling for loot
+    loot = registry.sample(5)
+    print("Loot: {}".format(", ".join(weapon.name for weapon in loot)))
+
     for weapon_type, weapon in registry.get_objects().items():
         print("{} weapons are {} you have {}% chance of finding one.".format(
             weapon_type.capitalize(),
@@ -40,6 +40,12 @@ Consequences
 5. More flexible than class operations
 """
 
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
 # A pythonic way of Singleton implementation is does using a Borg Pattern
 # instead of only having one instance, there are multiple that share the
 # same state.
@@ -55,6 +61,348 @@ class Borg:
         return self.state
 
 
+class _VersionedState:
+    """The state shared by every VersionedBorg, guarded by one condition"""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.values = {}
+        self.changed_at = {}
+        self.version = 0
+        self.batch_depth = 0
+        self.batch_dirty = False
+        self.pending = {}
+        self.delivered = 0
+        self.subscribers = []
+        self.dispatcher = None
+
+
+class VersionedBorg:
+    """ A thread-safe Borg that counts its changes.
+
+    Every write, or every ``batch()`` of writes, bumps ``version``. Readers
+    can compare it with the last version they saw and ask for just the
+    fields that changed since. Subscribers are called from a dispatcher
+    thread with the changes coalesced since their previous call, so a burst
+    of writes results in a single callback.
+    """
+    __shared = _VersionedState()
+
+    def __init__(self):
+        shared = self.__shared
+        with shared.condition:
+            if "state" not in shared.values:
+                self.state = 'Init'
+
+    def __getattr__(self, name):
+        try:
+            return self.__shared.values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        shared = self.__shared
+        with shared.condition:
+            shared.values[name] = value
+            if shared.dispatcher is not None:
+                shared.pending[name] = value
+            if shared.batch_depth:
+                shared.changed_at[name] = shared.version + 1
+                shared.batch_dirty = True
+            else:
+                self._publish(shared, [name])
+
+    @staticmethod
+    def _publish(shared, names):
+        shared.version += 1
+        for name in names:
+            shared.changed_at[name] = shared.version
+        shared.condition.notify_all()
+
+    @property
+    def version(self):
+        return self.__shared.version
+
+    @contextmanager
+    def batch(self):
+        """Make every write in the block a single version"""
+        shared = self.__shared
+        with shared.condition:
+            shared.batch_depth += 1
+            try:
+                yield self
+            finally:
+                shared.batch_depth -= 1
+            if not shared.batch_depth and shared.batch_dirty:
+                shared.batch_dirty = False
+                self._publish(shared, [])
+
+    def changes_since(self, version):
+        """Return the current version and the fields changed after
+        ``version``.
+        """
+        shared = self.__shared
+        with shared.condition:
+            changes = {name: shared.values[name]
+                       for name, changed in shared.changed_at.items()
+                       if changed > version}
+            return shared.version, changes
+
+    def subscribe(self, callback):
+        """ Call ``callback(version, changes)`` with each coalesced batch of
+        changes. Returns a function that unsubscribes. An exception raised
+        by a callback is passed to ``sys.excepthook`` and doesn't stop the
+        other callbacks.
+        """
+        shared = self.__shared
+        with shared.condition:
+            shared.subscribers.append(callback)
+            if shared.dispatcher is None:
+                shared.delivered = shared.version
+                shared.pending.clear()
+                shared.dispatcher = threading.Thread(
+                    target=self._dispatch, args=(shared,), daemon=True)
+                shared.dispatcher.start()
+
+        def unsubscribe():
+            with shared.condition:
+                shared.subscribers.remove(callback)
+
+        return unsubscribe
+
+    @staticmethod
+    def _dispatch(shared):
+        while True:
+            with shared.condition:
+                while (shared.delivered == shared.version
+                       or shared.batch_depth):
+                    shared.condition.wait()
+                version = shared.version
+                changes, shared.pending = shared.pending, {}
+                subscribers = list(shared.subscribers)
+            try:
+                for callback in subscribers:
+                    try:
+                        callback(version, changes)
+                    except Exception:
+                        sys.excepthook(*sys.exc_info())
+            finally:
+                with shared.condition:
+                    shared.delivered = version
+                    shared.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until subscribers have seen the current version"""
+        shared = self.__shared
+        with shared.condition:
+            if shared.dispatcher is None:
+                return True
+            version = shared.version
+            return shared.condition.wait_for(
+                lambda: shared.delivered >= version, timeout)
+
+    def __str__(self):
+        return self.state
+
+
+class SharedBorg:
+    """ A Borg whose state is shared between processes.
+
+    The state is a fixed set of typed fields, declared as ``(name, struct
+    format)`` pairs, laid out in one shared memory block. Each field has
+    its own lock so writers of different fields don't contend. Create the
+    state once with ``SharedBorg.create()`` and pass the instance to other
+    processes, which attach to the same block. multiprocessing is only
+    imported once shared state is created or attached to.
+    """
+
+    fields = (
+        ("state", "32s"),
+        ("jobs", "q"),
+        ("load", "d"),
+    )
+
+    def __init__(self, memory, locks):
+        layout = {}
+        offset = 0
+        for name, fmt in self.fields:
+            field = struct.Struct("<" + fmt)
+            layout[name] = offset, field
+            offset += field.size
+        object.__setattr__(self, "_layout", layout)
+        object.__setattr__(self, "_memory", memory)
+        object.__setattr__(self, "_locks", locks)
+        object.__setattr__(self, "_pending", None)
+
+    @classmethod
+    def size(cls):
+        return sum(struct.calcsize("<" + fmt) for _, fmt in cls.fields)
+
+    @classmethod
+    def create(cls, **initial):
+        import multiprocessing
+        from multiprocessing import shared_memory
+
+        memory = shared_memory.SharedMemory(create=True, size=cls.size())
+        locks = {name: multiprocessing.Lock() for name, _ in cls.fields}
+        borg = cls(memory, locks)
+        with borg.batch():
+            for name, value in initial.items():
+                setattr(borg, name, value)
+        return borg
+
+    def __reduce__(self):
+        return self._attach, (self._memory.name, self._locks)
+
+    @classmethod
+    def _attach(cls, memory_name, locks):
+        from multiprocessing import shared_memory
+
+        return cls(shared_memory.SharedMemory(name=memory_name), locks)
+
+    def _read(self, name):
+        offset, field = self._layout[name]
+        (value,) = field.unpack_from(self._memory.buf, offset)
+        if isinstance(value, bytes):
+            value = value.rstrip(b"\0").decode("utf-8")
+        return value
+
+    def _pack(self, name, value):
+        """ Encode a field's value, raising ValueError if it doesn't fit and
+        TypeError if it has the wrong type.
+        """
+        field = self._layout[name][1]
+        if field.format.endswith("s"):
+            if isinstance(value, str):
+                value = value.encode("utf-8")
+            if not isinstance(value, bytes):
+                raise TypeError("field {!r} holds a string, got {}".format(
+                    name, type(value).__name__))
+            if len(value) > field.size:
+                raise ValueError("field {!r} holds {} bytes, got {}".format(
+                    name, field.size, len(value)))
+        elif isinstance(value, (str, bytes)):
+            raise TypeError("field {!r} holds a number, got {}".format(
+                name, type(value).__name__))
+        try:
+            return field.pack(value)
+        except struct.error as error:
+            raise ValueError("field {!r}: {}".format(name, error)) from None
+
+    def _write(self, name, packed):
+        offset = self._layout[name][0]
+        self._memory.buf[offset:offset + len(packed)] = packed
+
+    def __getattr__(self, name):
+        if name not in self._layout:
+            raise AttributeError(name)
+        pending = self._pending
+        if pending is not None and name in pending:
+            return pending[name]
+        with self._locks[name]:
+            return self._read(name)
+
+    def __setattr__(self, name, value):
+        if name not in self._layout:
+            raise AttributeError("{} has no shared field {!r}".format(
+                type(self).__name__, name))
+        packed = self._pack(name, value)
+        if self._pending is not None:
+            self._pending[name] = value
+            return
+        with self._locks[name]:
+            self._write(name, packed)
+
+    def update(self, name, function):
+        """Replace a field with ``function(value)`` under its lock"""
+        with self._locks[name]:
+            self._write(name, self._pack(name, function(self._read(name))))
+
+    @contextmanager
+    def batch(self):
+        """ Collect writes and commit them together on exit, holding the
+        lock of every field written.
+        """
+        object.__setattr__(self, "_pending", {})
+        try:
+            yield self
+            pending = self._pending
+        finally:
+            object.__setattr__(self, "_pending", None)
+        names = [name for name, _ in self.fields if name in pending]
+        packed = [self._pack(name, pending[name]) for name in names]
+        for name in names:
+            self._locks[name].acquire()
+        try:
+            for name, value in zip(names, packed):
+                self._write(name, value)
+        finally:
+            for name in reversed(names):
+                self._locks[name].release()
+
+    def snapshot(self):
+        """Read every field at once as a dict"""
+        names = [name for name, _ in self.fields]
+        for name in names:
+            self._locks[name].acquire()
+        try:
+            return {name: self._read(name) for name in names}
+        finally:
+            for name in reversed(names):
+                self._locks[name].release()
+
+    def close(self):
+        self._memory.close()
+
+    def unlink(self):
+        """Free the shared block, once every process is done with it"""
+        self._memory.unlink()
+
+    def __str__(self):
+        return self.state
+
+
+def _shared_worker(borg, jobs):
+    with borg.batch():
+        borg.state = "Running"
+        borg.load = 1.0
+    for _ in range(jobs):
+        borg.update("jobs", lambda done: done + 1)
+    borg.close()
+
+
+def benchmark_shared(operations=100000):
+    """Compare field latency with a multiprocessing.Manager dict"""
+    import multiprocessing
+
+    borg = SharedBorg.create(state="Init", jobs=0, load=0.0)
+    with multiprocessing.Manager() as manager:
+        managed = manager.dict(state="Init", jobs=0, load=0.0)
+
+        def timed(run):
+            start = time.perf_counter()
+            for i in range(operations):
+                run(i)
+            return (time.perf_counter() - start) / operations * 1e6
+
+        def borg_write(i):
+            borg.jobs = i
+
+        def managed_write(i):
+            managed["jobs"] = i
+
+        results = (
+            ("SharedBorg read", timed(lambda i: borg.jobs)),
+            ("SharedBorg write", timed(borg_write)),
+            ("Manager dict read", timed(lambda i: managed["jobs"])),
+            ("Manager dict write", timed(managed_write)),
+        )
+    borg.close()
+    borg.unlink()
+    for label, latency in results:
+        print("{:<18} {:8.2f}us".format(label, latency))
+
+
 if __name__ == '__main__':
     rm1 = Borg()
     rm2 = Borg()
@@ -69,3 +417,32 @@ if __name__ == '__main__':
 
     print("rm1: {0}".format(rm1))
     print("rm2: {0}".format(rm2))
+
+    # Watching for changes instead of polling
+    vb1 = VersionedBorg()
+    vb2 = VersionedBorg()
+    seen = vb1.version
+    vb1.subscribe(lambda version, changes: print(
+        "version {}: {}".format(version, changes)))
+    with vb2.batch():
+        vb2.state = 'Running'
+        vb2.state = 'Zombie'
+        vb2.jobs = 3
+    vb1.flush()
+    print("vb1 changes since {}: {}".format(seen, vb1.changes_since(seen)))
+
+    # Sharing state with other processes
+    import multiprocessing
+
+    shared = SharedBorg.create(state="Init", jobs=0)
+    workers = [
+        multiprocessing.Process(target=_shared_worker, args=(shared, 10))
+        for _ in range(2)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    print("shared: {0}".format(shared.snapshot()))
+    shared.close()
+    shared.unlink()
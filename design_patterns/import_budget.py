@@ -0,0 +1,69 @@
+"""
+Import-time budget for the design_patterns package.
+
+Every module is imported in a fresh interpreter with ``-X importtime`` and
+the cumulative time of its own import is compared against a budget. Run as
+
+    python -m design_patterns.import_budget
+
+and a non-zero exit status is returned when any import is over budget.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+import design_patterns
+
+#: Budgets in milliseconds, on top of the interpreter's own start up.
+PACKAGE_BUDGET = 5.0
+MODULE_BUDGET = 25.0
+
+
+def import_time(module, repeat=5):
+    """Median cumulative import time of ``module`` in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import {}".format(module)],
+            capture_output=True, text=True, check=True,
+        )
+        for line in result.stderr.splitlines():
+            _, cumulative, name = line.split("|")
+            if name.strip() == module:
+                samples.append(int(cumulative) / 1000)
+    return statistics.median(samples)
+
+
+def modules():
+    yield "design_patterns", PACKAGE_BUDGET
+    for subpackage in design_patterns.__all__:
+        package = getattr(design_patterns, subpackage)
+        yield package.__name__, PACKAGE_BUDGET
+        for module in package.__all__:
+            yield "{}.{}".format(package.__name__, module), MODULE_BUDGET
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply every budget, e.g. on slow machines")
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    for module, budget in modules():
+        budget *= args.scale
+        elapsed = import_time(module, args.repeat)
+        flag = "" if elapsed <= budget else "  OVER BUDGET"
+        print("{:<50} {:7.2f}ms / {:.0f}ms{}".format(
+            module, elapsed, budget, flag))
+        if flag:
+            over_budget.append(module)
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,11 @@
+"""
+Python Patterns
+===============
+"""
+
+from design_patterns import _lazy
+
+__getattr__, __dir__, __all__ = _lazy.attach(__name__, [
+    "prebound_methods",
+    "sentinel_object",
+])
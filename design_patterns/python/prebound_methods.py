@@ -71,5 +71,5 @@ _instance = Deck()
 
 draw = _instance.draw
 peak = _instance.peak
-shuffle_card = _instance.shuffle
+shuffle_card = _instance.shuffle_card
 to_bottom = _instance.to_bottom
@@ -0,0 +1,16 @@
+"""
+Structural Patterns
+===================
+"""
+
+from design_patterns import _lazy
+
+__getattr__, __dir__, __all__ = _lazy.attach(__name__, [
+    "adapter",
+    "bridge",
+    "composite",
+    "decorator",
+    "facade",
+    "flyweight",
+    "proxy",
+])